@@ -1,61 +1,462 @@
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
+from functools import wraps
+from itertools import accumulate, islice
+from urllib.parse import parse_qs, quote, urlsplit
+import asyncio
+import csv
+import gc
 import os
+import random
+import re
+import secrets
 import hashlib
+import heapq
+import hmac
+import json
+import math
+import mmap
+import multiprocessing
+import queue
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # ================= CONFIG =================
 MAX_BOOKS_PER_MEMBER = 2
 FINE_PER_DAY = 1000
 BOOKS_FILE = "books.txt"
 MEMBERS_FILE = "members.txt"
+JOURNAL_FILE = "journal.txt"
+# snapshot format for books: "text" (BOOKS_FILE) or "binary" (BOOKS_BIN_FILE)
+BOOKS_FORMAT = "text"
+BOOKS_BIN_FILE = "books.bin"
+# fold the journal into the snapshot files after this many entries
+JOURNAL_MAX_ENTRIES = 100000
+
+# "text" (books.txt/members.txt + journal) or "sqlite" (SQLITE_FILE)
+STORAGE = "text"
+SQLITE_FILE = "library.db"
+
+# "fsync": fsync the journal after every operation (in concurrent mode the
+#          writer thread does it, so only once sync() has returned)
+# "group": buffer entries and fsync every GROUP_COMMIT_OPS ops / GROUP_COMMIT_MS
+# "none":  hand writes to the OS and never fsync
+DURABILITY = "group"
+GROUP_COMMIT_MS = 50
+GROUP_COMMIT_OPS = 100
+
+# "objects" keeps a list of Book objects; "columnar" keeps the catalog in
+# parallel arrays and hands out BookView objects on demand
+CATALOG_STORE = "objects"
+
+CASE_INSENSITIVE_USERNAMES = False
+
+# concurrent mode: borrow/return lock only the title and member involved
+# (striped over LOCK_STRIPES locks each) and a writer thread persists after
+# the call has returned
+CONCURRENT = False
+LOCK_STRIPES = 64
+
+# shared mode: several processes use the same data files. Every change is
+# made under a cross-process lock (fcntl on LOCK_FILE for text storage, a
+# write transaction for sqlite) after catching up on the others' changes.
+SHARED_FILES = False
+LOCK_FILE = "library.lock"
+SHARED_RETRIES = 5
 
 MAX_LOGIN_ATTEMPTS = 3
 LOCK_MINUTES = 5
+# failed logins per source address: a burst of SOURCE_ATTEMPTS, then one
+# more every SOURCE_REFILL_SECONDS
+SOURCE_ATTEMPTS = 20
+SOURCE_REFILL_SECONDS = 6
+# timing wheel that forgets idle attempt counters
+WHEEL_TICK = 1.0
+WHEEL_SLOTS = 512
+
+# login sessions: at most SESSION_MAX, each dropped after SESSION_IDLE_MINUTES
+# unused; the least recently used goes first when the cache is full
+SESSION_MAX = 10000
+SESSION_IDLE_MINUTES = 30
+
+# password hashing: "pbkdf2", "scrypt" or "sha256" (legacy, unsalted).
+# Stored hashes with other settings are rehashed on the next login.
+PASSWORD_KDF = "pbkdf2"
+PBKDF2_ITERATIONS = 200000
+SCRYPT_PARAMS = (2 ** 14, 8, 1)  # n, r, p
+
+REMINDER_HOURS = 24
+SEARCH_LIMIT = 10
+COMPLETION_LIMIT = 5
+PAGE_SIZE = 20
+# rows added per batch (one commit each) by import_books
+IMPORT_CHUNK = 5000
+
+# kiosk service: python library_system05.py serve | loadtest [kiosks] [rounds]
+# benchmarks: python library_system05.py bench <name> [sizes...]
+# self-checks: python library_system05.py check <name> [sizes...]
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8080
+# threads running library calls, so also the most passwords hashed at once
+SERVICE_WORKERS = 8
+# most books one /books or /search reply may hold; those run on the event loop
+SERVICE_MAX_LIMIT = PAGE_SIZE * 10
 
 # ================= SECURITY =================
-def hash_password(password):
+# Stored as "pbkdf2_sha256$iterations$salt$hash" or "scrypt$n$r$p$salt$hash"
+# (hex salt and hash); a bare hex digest is a legacy unsalted SHA-256.
+def legacy_hash(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+def kdf_prefix(kdf=None):
+    kdf = kdf or PASSWORD_KDF
+    if kdf == "pbkdf2":
+        return f"pbkdf2_sha256${PBKDF2_ITERATIONS}$"
+    if kdf == "scrypt":
+        n, r, p = SCRYPT_PARAMS
+        return f"scrypt${n}${r}${p}$"
+    if kdf == "sha256":
+        return ""
+    raise ValueError(f"unknown password kdf: {kdf}")
+
+def derive(password, params, salt):
+    if params[0] == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac(
+            "sha256", password.encode(), salt, int(params[1])
+        )
+    n, r, p = map(int, params[1:4])
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 2 ** 20
+    )
+
+def hash_password(password, kdf=None):
+    prefix = kdf_prefix(kdf)
+    if not prefix:
+        return legacy_hash(password)
+    salt = os.urandom(16)
+    digest = derive(password, prefix.split("$")[:-1], salt)
+    return f"{prefix}{salt.hex()}${digest.hex()}"
+
+def verify_password(password, stored):
+    params = stored.split("$")
+    if len(params) == 1:
+        return hmac.compare_digest(legacy_hash(password), stored)
+    salt, digest = params[-2:]
+    computed = derive(password, params[:-2], bytes.fromhex(salt))
+    return hmac.compare_digest(computed.hex(), digest)
+
+def needs_rehash(stored):
+    prefix = kdf_prefix()
+    return bool(prefix) and not stored.startswith(prefix)
+
+def title_key(title):
+    return title.casefold()
+
+def username_key(username):
+    if CASE_INSENSITIVE_USERNAMES:
+        return username.casefold()
+    return username
+
+TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold())
+
+def sorted_contains(values, x):
+    i = bisect_left(values, x)
+    return i < len(values) and values[i] == x
+
+# text that can be stored in a pipe-delimited record or a comma-separated
+# loan list
+def valid_field(text):
+    return bool(text.strip()) and not any(c in text for c in "|,\n")
+
+# identifies a stored record: ("B", book id) or ("M", username)
+def record_key(item):
+    if isinstance(item, Book):
+        return ("B", item.id)
+    return ("M", item.username)
+
+# bulk loads allocate millions of objects without creating cycles, so the
+# cyclic collector would only rescan them over and over
+@contextmanager
+def paused_gc():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+# due dates are naive local datetimes; as integers they are microseconds
+# since a naive epoch so day arithmetic matches datetime subtraction exactly
+EPOCH = datetime(1970, 1, 1)
+NO_DATE = -(2 ** 63)
+
+def to_epoch_us(dt):
+    if dt is None:
+        return NO_DATE
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+def from_epoch_us(us):
+    if us == NO_DATE:
+        return None
+    return EPOCH + timedelta(microseconds=us)
+
+# ================= THROTTLING =================
+# Failed logins are counted in memory, in token buckets keyed by username
+# or source address. A bucket holds `capacity` attempts and gains one back
+# every `refill` seconds. Once a bucket would be full again it means
+# nothing, so a hashed timing wheel drops it: slot = expiry tick % slots,
+# and each tick only looks at its own slot.
+class TokenBuckets:
+    def __init__(self, capacity, refill, tick=WHEEL_TICK, slots=WHEEL_SLOTS):
+        self.capacity = capacity
+        self.refill = refill
+        self.tick = tick
+        # key -> [tokens, updated at, expiry tick]
+        self.buckets = {}
+        self.wheel = [set() for _ in range(slots)]
+        # last tick the wheel was turned to
+        self.current = None
+        self.lock = threading.Lock()
+        self.stats = {"expired": 0}
+
+    def tokens(self, bucket, now):
+        return min(self.capacity, bucket[0] + (now - bucket[1]) / self.refill)
+
+    # uses up one attempt and returns how many are left; a new bucket
+    # starts with `used` attempts already gone
+    def take(self, key, now=None, used=0):
+        now = now or time.monotonic()
+        with self.lock:
+            self.advance(now)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                tokens = self.capacity - used
+                bucket = self.buckets[key] = [0, now, None]
+            else:
+                tokens = self.tokens(bucket, now)
+                self.wheel[bucket[2] % len(self.wheel)].discard(key)
+            bucket[0] = tokens - 1
+            bucket[1] = now
+            full_at = now + (self.capacity - bucket[0]) * self.refill
+            bucket[2] = int(full_at / self.tick) + 1
+            self.wheel[bucket[2] % len(self.wheel)].add(key)
+            return bucket[0]
+
+    # seconds until the key has an attempt left, 0 if it has one now
+    def wait(self, key, now=None):
+        now = now or time.monotonic()
+        with self.lock:
+            self.advance(now)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                return 0
+            return max(0, (1 - self.tokens(bucket, now)) * self.refill)
+
+    def clear(self, key):
+        with self.lock:
+            bucket = self.buckets.pop(key, None)
+            if bucket:
+                self.wheel[bucket[2] % len(self.wheel)].discard(key)
+
+    def advance(self, now):
+        target = int(now / self.tick)
+        if self.current is None:
+            self.current = target
+        # after a long pause one turn of the wheel covers every slot
+        start = max(self.current + 1, target - len(self.wheel) + 1)
+        for tick in range(start, target + 1):
+            slot = self.wheel[tick % len(self.wheel)]
+            for key in [k for k in slot if self.buckets[k][2] <= target]:
+                slot.discard(key)
+                del self.buckets[key]
+                self.stats["expired"] += 1
+        self.current = max(self.current, target)
+
+    def __len__(self):
+        return len(self.buckets)
+
+# ================= SESSIONS =================
+# token -> [member, last used], kept in least-recently-used order so both
+# the LRU eviction and idle expiry only ever look at the front
+class SessionCache:
+    def __init__(self, size=SESSION_MAX, idle_minutes=SESSION_IDLE_MINUTES):
+        self.size = size
+        self.idle = idle_minutes * 60
+        self.sessions = OrderedDict()
+        # username key -> tokens, to end all of a member's sessions at once
+        self.by_member = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def create(self, member):
+        token = secrets.token_urlsafe(32)
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            while len(self.sessions) >= self.size:
+                self.drop(next(iter(self.sessions)))
+                self.stats["evictions"] += 1
+            self.sessions[token] = [member, now]
+            self.by_member.setdefault(username_key(member.username), set()).add(token)
+        return token
+
+    # the member for a live token, or None
+    def get(self, token):
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(token)
+            if session and now - session[1] > self.idle:
+                self.drop(token)
+                self.stats["expirations"] += 1
+                session = None
+            if not session:
+                self.stats["misses"] += 1
+                return None
+            session[1] = now
+            self.sessions.move_to_end(token)
+            self.stats["hits"] += 1
+            return session[0]
+
+    def revoke(self, token):
+        with self.lock:
+            if token in self.sessions:
+                self.drop(token)
+
+    def revoke_member(self, username):
+        with self.lock:
+            for token in list(self.by_member.get(username_key(username), ())):
+                self.drop(token)
+
+    def expire(self, now):
+        while self.sessions:
+            token, session = next(iter(self.sessions.items()))
+            if now - session[1] <= self.idle:
+                break
+            self.drop(token)
+            self.stats["expirations"] += 1
+
+    def drop(self, token):
+        member = self.sessions.pop(token)[0]
+        key = username_key(member.username)
+        tokens = self.by_member[key]
+        tokens.discard(token)
+        if not tokens:
+            del self.by_member[key]
+
+    def __len__(self):
+        return len(self.sessions)
+
+# ================= RESULTS =================
+# Library operations return a Result instead of printing: ok, a short
+# machine-readable code, the user-facing message and any extra data.
+class Result:
+    __slots__ = ("ok", "code", "message", "data")
+
+    def __init__(self, ok, code, message, **data):
+        self.ok = ok
+        self.code = code
+        self.message = message
+        self.data = data
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return f"Result({self.ok}, {self.code!r}, {self.message!r})"
+
+def success(message, **data):
+    return Result(True, "ok", message, **data)
+
+def failure(code, message):
+    return Result(False, code, message)
+
 # ================= BOOK =================
 class Book:
+    __slots__ = (
+        "title", "author", "is_borrowed", "due_date", "borrowed_by",
+        "id", "library", "dirty", "version",
+    )
+
     def __init__(self, title, author):
         self.title = title
         self.author = author
         self.is_borrowed = False
         self.due_date = None
         self.borrowed_by = None
+        self.id = None
+        self.library = None
+        self.dirty = False
+        # seq of the stored change this state came from, 0 for the snapshot
+        self.version = 0
 
     def borrow(self, member):
         self.is_borrowed = True
         self.borrowed_by = member.username
         self.due_date = datetime.now() + timedelta(days=7)
+        self.dirty = True
+        if self.library:
+            self.library.book_borrowed(self)
 
     def return_book(self):
         self.is_borrowed = False
         self.borrowed_by = None
         self.due_date = None
+        self.dirty = True
+        if self.library:
+            self.library.book_returned(self)
 
-    def fine(self):
-        if self.due_date and datetime.now() > self.due_date:
-            return (datetime.now() - self.due_date).days * FINE_PER_DAY
+    def fine(self, now=None):
+        now = now or datetime.now()
+        if self.due_date and now > self.due_date:
+            return (now - self.due_date).days * FINE_PER_DAY
         return 0
 
     def to_file(self):
         return f"{self.title}|{self.author}|{self.is_borrowed}|{self.due_date}|{self.borrowed_by}\n"
 
+    # repeated strings (authors, borrowers) are interned so each is stored once
     @classmethod
     def from_file(cls, line):
         parts = line.strip().split("|")
         if len(parts) != 5:
             return None
         title, author, borrowed, due, by = parts
-        book = cls(title, author)
+        book = cls(title, sys.intern(author))
         book.is_borrowed = borrowed == "True"
         book.due_date = None if due == "None" else datetime.fromisoformat(due)
-        book.borrowed_by = None if by == "None" else by
+        book.borrowed_by = None if by == "None" else sys.intern(by)
         return book
 
 # ================= MEMBER =================
 class Member:
+    __slots__ = (
+        "username", "password", "role", "books", "failed_attempts",
+        "lock_until", "dirty", "version",
+    )
+
     def __init__(self, username, password, role="member",
                  books=None, failed_attempts=0, lock_until=None):
         self.username = username
@@ -64,10 +465,49 @@ class Member:
         self.books = books or []
         self.failed_attempts = failed_attempts
         self.lock_until = lock_until
+        self.dirty = False
+        self.version = 0
+
+    # takes over the stored state of this member as read back from storage
+    def load_state(self, other):
+        self.password = other.password
+        self.role = other.role
+        self.books = other.books
+        self.failed_attempts = other.failed_attempts
+        self.lock_until = other.lock_until
+        self.version = other.version
+        self.dirty = False
 
     def is_admin(self):
         return self.role == "admin"
 
+    def can_borrow(self):
+        return len(self.books) < MAX_BOOKS_PER_MEMBER
+
+    def add_loan(self, title):
+        self.books.append(title)
+        self.dirty = True
+
+    def remove_loan(self, title):
+        self.books.remove(title)
+        self.dirty = True
+
+    def set_password(self, password):
+        if password != self.password:
+            self.password = password
+            self.dirty = True
+
+    def reset_login_state(self):
+        if self.failed_attempts or self.lock_until:
+            self.failed_attempts = 0
+            self.lock_until = None
+            self.dirty = True
+
+    def lock_out(self):
+        self.failed_attempts = MAX_LOGIN_ATTEMPTS
+        self.lock_until = datetime.now() + timedelta(minutes=LOCK_MINUTES)
+        self.dirty = True
+
     def is_locked(self):
         if self.lock_until and datetime.now() < self.lock_until:
             return True
@@ -95,161 +535,3161 @@ class Member:
         failed = int(parts[4])
         lock = None if parts[5] == "None" else datetime.fromisoformat(parts[5])
 
-        return cls(parts[0], parts[1], parts[2], books, failed, lock)
+        return cls(parts[0], parts[1], sys.intern(parts[2]), books, failed, lock)
 
-# ================= LIBRARY =================
-class Library:
-    def __init__(self):
-        self.books = []
-        self.members = []
-        self.setup_files()
-        self.load_books()
-        self.load_members()
+# ================= COLUMNAR CATALOG =================
+# A lightweight Book over one row of a ColumnarBooks store. The Book
+# methods (borrow, return_book, fine, to_file) work unchanged because
+# every field they touch is a property reading or writing the columns.
+class BookView(Book):
+    __slots__ = ("store",)
+
+    def __init__(self, store, book_id):
+        self.store = store
+        self.id = book_id
+
+    @property
+    def title(self):
+        return self.store.titles[self.id]
+
+    @property
+    def author(self):
+        return self.store.strings[self.store.author_ids[self.id]]
+
+    @property
+    def is_borrowed(self):
+        return bool(self.store.borrowed[self.id])
+
+    @is_borrowed.setter
+    def is_borrowed(self, value):
+        self.store.borrowed[self.id] = bool(value)
+
+    @property
+    def due_date(self):
+        return from_epoch_us(self.store.due[self.id])
+
+    @due_date.setter
+    def due_date(self, value):
+        self.store.due[self.id] = to_epoch_us(value)
+
+    @property
+    def borrowed_by(self):
+        i = self.store.borrower_ids[self.id]
+        return None if i == NO_BORROWER else self.store.strings[i]
+
+    @borrowed_by.setter
+    def borrowed_by(self, value):
+        self.store.borrower_ids[self.id] = (
+            NO_BORROWER if value is None else self.store.string_id(value)
+        )
+
+    @property
+    def dirty(self):
+        return bool(self.store.dirty[self.id])
+
+    @dirty.setter
+    def dirty(self, value):
+        self.store.dirty[self.id] = bool(value)
+
+    @property
+    def version(self):
+        return self.store.versions.get(self.id, 0)
+
+    @version.setter
+    def version(self, value):
+        self.store.versions[self.id] = value
+
+    @property
+    def library(self):
+        return self.store.library
+
+# Titles are nearly all distinct, so they sit in a plain list indexed by
+# book id; authors and borrowers repeat and go through the string table.
+class ColumnarBooks:
+    def __init__(self, library=None):
+        self.library = library
+        self.titles = []
+        self.strings = []
+        self.string_ids = {}
+        self.author_ids = array("I")
+        self.borrowed = bytearray()
+        self.due = array("q")
+        self.borrower_ids = array("i")
+        self.dirty = bytearray()
+        # book id -> version, for the few books changed since the snapshot
+        self.versions = {}
+        # borrowers are added from whichever thread lends the book
+        self.lock = threading.Lock()
+
+    def string_id(self, s):
+        i = self.string_ids.get(s)
+        if i is None:
+            with self.lock:
+                i = self.string_ids.get(s)
+                if i is None:
+                    i = self.string_ids[s] = len(self.strings)
+                    self.strings.append(s)
+        return i
+
+    def append(self, book):
+        self.titles.append(book.title)
+        self.author_ids.append(self.string_id(book.author))
+        self.borrowed.append(book.is_borrowed)
+        self.due.append(to_epoch_us(book.due_date))
+        self.borrower_ids.append(
+            NO_BORROWER if book.borrowed_by is None
+            else self.string_id(book.borrowed_by)
+        )
+        self.dirty.append(book.dirty)
+        if book.version:
+            self.versions[len(self.titles) - 1] = book.version
+
+    # takes over a binary snapshot column by column, into an empty store
+    def load_catalog(self, catalog):
+        self.strings = catalog.all_strings()
+        self.titles = list(map(self.strings.__getitem__, catalog.column("title_ids")))
+        self.author_ids = catalog.column("author_ids")
+        self.borrower_ids = catalog.column("borrower_ids")
+        self.due = catalog.column("due")
+        self.borrowed = bytearray(catalog.column("borrowed"))
+        self.dirty = bytearray(len(self.titles))
+        # only authors and borrowers are looked up by value
+        used = set(self.author_ids).union(self.borrower_ids)
+        used.discard(NO_BORROWER)
+        self.string_ids = {self.strings[i]: i for i in used}
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.titles)
+        if not 0 <= i < len(self.titles):
+            raise IndexError(i)
+        return BookView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self.titles)):
+            yield BookView(self, i)
+
+# ================= FINES =================
+# Outstanding fines for every borrowed book against one reference time,
+# as {username: total}. Uses the same rule as Book.fine: whole days past
+# the due date times FINE_PER_DAY. Members owing nothing are left out.
+DAY_US = 86400 * 10 ** 6
+
+def fine_totals(books, now=None):
+    now_us = to_epoch_us(now or datetime.now())
+    if isinstance(books, ColumnarBooks):
+        if np is not None:
+            return columnar_fine_totals_np(books, now_us)
+        return columnar_fine_totals(books, now_us)
+    totals = {}
+    for b in books:
+        if b.is_borrowed and b.due_date:
+            late = now_us - to_epoch_us(b.due_date)
+            if late >= DAY_US:
+                totals[b.borrowed_by] = (
+                    totals.get(b.borrowed_by, 0)
+                    + late // DAY_US * FINE_PER_DAY
+                )
+    return totals
+
+def columnar_fine_totals(store, now_us):
+    by_id = {}
+    borrowed, borrower_ids = store.borrowed, store.borrower_ids
+    cutoff = now_us - DAY_US
+    for i, due in enumerate(store.due):
+        if due != NO_DATE and due <= cutoff and borrowed[i]:
+            by = borrower_ids[i]
+            by_id[by] = by_id.get(by, 0) + (now_us - due) // DAY_US * FINE_PER_DAY
+    return {store.strings[i]: total for i, total in by_id.items()}
+
+def columnar_fine_totals_np(store, now_us):
+    due = np.frombuffer(store.due, dtype=np.int64)
+    borrowed = np.frombuffer(store.borrowed, dtype=np.uint8)
+    late = np.flatnonzero(
+        (borrowed != 0) & (due != NO_DATE) & (due <= now_us - DAY_US)
+    )
+    if not len(late):
+        return {}
+    fines = (now_us - due[late]) // DAY_US * FINE_PER_DAY
+    borrowers = np.frombuffer(store.borrower_ids, dtype=np.int32)[late]
+    ids, inverse = np.unique(borrowers, return_inverse=True)
+    sums = np.zeros(len(ids), dtype=np.int64)
+    np.add.at(sums, inverse, fines)
+    return {store.strings[i]: int(t) for i, t in zip(ids.tolist(), sums.tolist())}
+
+# ================= BINARY CATALOG =================
+# header | columns | string offsets | utf-8 strings, each ending in "\n"
+# One column per field, each value fixed-size and little-endian: titles,
+# authors and borrowers are ids into the string table and due dates are
+# epoch microseconds. A columnar catalog copies the columns straight out of
+# the map, so no object is built per row.
+CATALOG_MAGIC = b"LBC2"
+CATALOG_HEADER = struct.Struct("<4sIII")     # magic, record count, string count, unused
+CATALOG_COLUMNS = (
+    ("due", "q"), ("title_ids", "I"), ("author_ids", "I"),
+    ("borrower_ids", "i"), ("borrowed", "B"),
+)
+CATALOG_OFFSET = struct.Struct("<I")
+NO_BORROWER = -1
+
+class BinaryCatalog:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.string_count, _ = CATALOG_HEADER.unpack_from(self.map)
+        if magic != CATALOG_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a binary catalog")
+        # name -> (struct for one value, offset of the column)
+        self.columns = {}
+        at = CATALOG_HEADER.size
+        for name, typecode in CATALOG_COLUMNS:
+            value = struct.Struct("<" + typecode)
+            self.columns[name] = (value, at)
+            at += self.count * value.size
+        self.offsets_at = at
+        self.strings_at = at + (self.string_count + 1) * CATALOG_OFFSET.size
+        self.strings = {}
+
+    def string(self, i):
+        s = self.strings.get(i)
+        if s is None:
+            at = self.offsets_at + i * CATALOG_OFFSET.size
+            start, = CATALOG_OFFSET.unpack_from(self.map, at)
+            end, = CATALOG_OFFSET.unpack_from(self.map, at + CATALOG_OFFSET.size)
+            s = str(self.map[self.strings_at + start:self.strings_at + end - 1], "utf-8")
+            self.strings[i] = s
+        return s
+
+    # the whole string table, decoded in one piece
+    def all_strings(self):
+        end, = CATALOG_OFFSET.unpack_from(
+            self.map, self.offsets_at + self.string_count * CATALOG_OFFSET.size
+        )
+        with memoryview(self.map)[self.strings_at:self.strings_at + end] as blob:
+            return str(blob, "utf-8").split("\n")[:-1]
+
+    # one column as an array, copied out of the map in one piece
+    def column(self, name):
+        value, at = self.columns[name]
+        values = array(value.format[1:])
+        with memoryview(self.map)[at:at + self.count * value.size] as data:
+            values.frombytes(data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def value(self, name, i):
+        value, at = self.columns[name]
+        return value.unpack_from(self.map, at + i * value.size)[0]
+
+    def __len__(self):
+        return self.count
+
+    # one record, reading only the bytes and strings it needs
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        book = Book(
+            self.string(self.value("title_ids", i)),
+            self.string(self.value("author_ids", i)),
+        )
+        book.is_borrowed = bool(self.value("borrowed", i))
+        book.due_date = from_epoch_us(self.value("due", i))
+        by = self.value("borrower_ids", i)
+        book.borrowed_by = None if by == NO_BORROWER else self.string(by)
+        return book
+
+    # every record as a Book, for an object catalog
+    def __iter__(self):
+        strings = [sys.intern(s) for s in self.all_strings()]
+        for due, title, author, by, borrowed in zip(
+            *(self.column(name) for name, _ in CATALOG_COLUMNS)
+        ):
+            book = Book(strings[title], strings[author])
+            if borrowed:
+                book.is_borrowed = True
+            if due != NO_DATE:
+                book.due_date = from_epoch_us(due)
+            if by != NO_BORROWER:
+                book.borrowed_by = strings[by]
+            yield book
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_binary_catalog(books, f):
+    ids = {}
+    def string_id(s):
+        i = ids.get(s)
+        if i is None:
+            i = ids[s] = len(ids)
+        return i
+
+    columns = {name: array(typecode) for name, typecode in CATALOG_COLUMNS}
+    due, title_ids, author_ids, borrower_ids, borrowed = columns.values()
+    for b in books:
+        due.append(to_epoch_us(b.due_date))
+        title_ids.append(string_id(b.title))
+        author_ids.append(string_id(b.author))
+        borrower_ids.append(
+            NO_BORROWER if b.borrowed_by is None else string_id(b.borrowed_by)
+        )
+        borrowed.append(b.is_borrowed)
+    blobs = [s.encode() + b"\n" for s in ids]
+    offsets = array("I", [0])
+    offsets.extend(accumulate(len(blob) for blob in blobs))
+    f.write(CATALOG_HEADER.pack(CATALOG_MAGIC, len(due), len(blobs), 0))
+    for values in (*columns.values(), offsets):
+        if sys.byteorder == "big":
+            values.byteswap()
+        f.write(values.tobytes())
+    f.write(b"".join(blobs))
+    return len(due)
+
+def convert_books_file(text_path=BOOKS_FILE, binary_path=BOOKS_BIN_FILE):
+    with open(text_path) as src, open(binary_path, "wb") as f:
+        return write_binary_catalog(
+            (b for b in map(Book.from_file, src) if b), f
+        )
+
+# ================= STORAGE =================
+# raised by a write in shared mode when a record was changed by another
+# process after this one read it
+class StaleWrite(Exception):
+    pass
+
+# A storage backend loads and saves whole collections (the snapshot) and
+# persists individual changed records through write(). Durability and
+# group commit are shared; backends implement write_records and flush.
+# With shared=True the backend also provides the cross-process lock
+# (acquire/release), the changes of other processes (tail) and the
+# version check that catches a write based on a stale record.
+class Storage:
+    def __init__(self, durability=DURABILITY, shared=SHARED_FILES):
+        if durability not in ("fsync", "group", "none"):
+            raise ValueError(f"unknown durability mode: {durability}")
+        self.durability = durability
+        self.shared = shared
+        self.stats = {"syncs": 0, "lock_wait": 0.0}
+        self.pending_ops = 0
+        self.last_sync = time.monotonic()
+        self.sync_timer = None
+        self.lock = threading.RLock()
+
+    def load_books(self):
+        raise NotImplementedError
+
+    def load_members(self):
+        raise NotImplementedError
+
+    # (BinaryCatalog, {book id: Book changed since}) for a snapshot that a
+    # columnar catalog can take over as it is, otherwise None
+    def map_books(self):
+        return None
+
+    def save_books(self, books):
+        raise NotImplementedError
+
+    def save_members(self, members):
+        raise NotImplementedError
+
+    def write_records(self, op, items):
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, books, members):
+        pass
+
+    # position of the latest change, for changed_since(position=...)
+    def position(self):
+        raise NotImplementedError
+
+    # (book ids, usernames) changed after a position or at/after a time,
+    # or None when that history was already compacted away
+    def changed_since(self, position=None, since=None):
+        raise NotImplementedError
+
+    # (books, members) changed by other processes since the last call, as
+    # {book id: Book} and [Member], or None when the history was compacted
+    # away and everything has to be loaded again
+    def tail(self):
+        return {}, []
+
+    # forget what was loaded, before loading everything again
+    def reset(self):
+        pass
+
+    def check_versions(self, items):
+        pass
+
+    # holds the cross-process lock in shared mode; a no-op otherwise
+    @contextmanager
+    def exclusive(self):
+        if not self.shared:
+            yield
+            return
+        with self.lock:
+            start = time.perf_counter()
+            self.acquire()
+            self.stats["lock_wait"] += time.perf_counter() - start
+            try:
+                yield
+            finally:
+                self.release()
+
+    def write(self, op, items):
+        with self.lock:
+            self.check_versions(items)
+            self.write_records(op, items)
+            self.commit()
+
+    # entries is a list of (op, item), committed once for the whole batch
+    def write_batch(self, entries):
+        with self.lock:
+            self.check_versions([item for _, item in entries])
+            for op, item in entries:
+                self.write_records(op, (item,))
+            self.commit()
+
+    def commit(self):
+        self.pending_ops += 1
+        if self.durability == "fsync":
+            self.sync()
+        elif self.durability == "none":
+            self.flush()
+            self.pending_ops = 0
+        elif (self.pending_ops >= GROUP_COMMIT_OPS
+              or (time.monotonic() - self.last_sync) * 1000 >= GROUP_COMMIT_MS):
+            self.sync()
+        elif not self.sync_timer:
+            # make sure a quiet period still commits within GROUP_COMMIT_MS
+            self.sync_timer = threading.Timer(GROUP_COMMIT_MS / 1000, self.sync)
+            self.sync_timer.daemon = True
+            self.sync_timer.start()
+
+    def sync(self):
+        with self.lock:
+            if self.sync_timer:
+                self.sync_timer.cancel()
+                self.sync_timer = None
+            if not self.pending_ops:
+                return
+            self.flush()
+            self.pending_ops = 0
+            self.last_sync = time.monotonic()
+            self.stats["syncs"] += 1
+
+    def close(self):
+        self.sync()
+
+
+class TextStorage(Storage):
+    # books.txt / members.txt are the snapshot; journal.txt holds one line
+    # per changed record since then: seq|timestamp|op|kind|key|record
+    # kind is B (key = book id) or M (key = username); record is to_file()
+    # Compaction starts the journal with a "compact" marker carrying the
+    # last seq, so positions keep increasing across compactions.
+    # In shared mode the processes take turns through an fcntl lock on
+    # lock_file and read each other's journal lines; a compaction replaces
+    # journal.txt, which the others notice by its new inode.
+    def __init__(self, durability=DURABILITY, books_file=BOOKS_FILE,
+                 members_file=MEMBERS_FILE, journal_file=JOURNAL_FILE,
+                 books_format=BOOKS_FORMAT, books_bin_file=BOOKS_BIN_FILE,
+                 shared=SHARED_FILES, lock_file=LOCK_FILE):
+        super().__init__(durability, shared)
+        if books_format not in ("text", "binary"):
+            raise ValueError(f"unknown books format: {books_format}")
+        if shared and fcntl is None:
+            raise ValueError("shared files need fcntl, not available here")
+        self.books_format = books_format
+        self.books_bin_file = books_bin_file
+        self.books_file = books_file
+        self.members_file = members_file
+        self.journal_file = journal_file
+        self.journal_seq = 0
+        # seq of the last compaction marker
+        self.journal_base = 0
+        # records changed since the snapshot files were last written
+        self.unsaved_books = False
+        self.unsaved_members = False
+        # shared mode: (kind, key) -> seq of the last journal line seen for
+        # it, and how far into the journal this process has read
+        self.versions = {}
+        self.journal_offset = 0
+        self.journal_replaced = False
+        if shared:
+            self.lock_file = open(lock_file, "a")
+        self.journal = open(journal_file, "a")
+        with self.exclusive():
+            self.setup_files()
 
-    # ---------- FILE SETUP ----------
     def setup_files(self):
-        if not os.path.exists(MEMBERS_FILE):
-            with open(MEMBERS_FILE, "w") as f:
+        if not os.path.exists(self.members_file):
+            with open(self.members_file, "w") as f:
                 f.write(
                     f"admin|{hash_password('admin123')}|admin||0|None\n"
                 )
 
-        if not os.path.exists(BOOKS_FILE):
-            with open(BOOKS_FILE, "w") as f:
+        if not os.path.exists(self.books_file):
+            with open(self.books_file, "w") as f:
                 f.write("AI for Beginners|John Doe|False|None|None\n")
 
-    def load_books(self):
-        with open(BOOKS_FILE) as f:
+        if (self.books_format == "binary"
+                and not os.path.exists(self.books_bin_file)):
+            convert_books_file(self.books_file, self.books_bin_file)
+
+    def read_journal(self, kind):
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file) as f:
+            self.journal_offset = os.fstat(f.fileno()).st_size
+            self.journal_replaced = False
             for line in f:
-                book = Book.from_file(line)
-                if book:
-                    self.books.append(book)
+                parts = line.split("|", 5)
+                # a torn last line from a crash has no complete record
+                if len(parts) != 6 or not line.endswith("\n"):
+                    continue
+                seq = int(parts[0])
+                self.journal_seq = max(self.journal_seq, seq)
+                if parts[2] == "compact":
+                    self.journal_base = seq
+                elif parts[3] == kind:
+                    yield seq, parts[4], parts[5]
+
+    def snapshot_books(self):
+        if self.books_format == "binary":
+            with BinaryCatalog(self.books_bin_file) as catalog:
+                yield from catalog
+        else:
+            with open(self.books_file) as f:
+                yield from (b for b in map(Book.from_file, f) if b)
+
+    def journal_books(self):
+        changes = {}
+        for seq, key, rest in self.read_journal("B"):
+            book = Book.from_file(rest)
+            if book:
+                book.version = seq
+                changes[int(key)] = book
+                if self.shared:
+                    self.versions["B", int(key)] = seq
+        if changes:
+            self.unsaved_books = True
+        return changes
+
+    def map_books(self):
+        if self.books_format != "binary":
+            return None
+        return BinaryCatalog(self.books_bin_file), self.journal_books()
+
+    # streams the snapshot with the records changed in the journal swapped
+    # in, so the caller never has to hold every Book at once
+    def load_books(self):
+        changes = self.journal_books()
+        book_id = 0
+        with paused_gc():
+            for book in self.snapshot_books():
+                yield changes.pop(book_id, book)
+                book_id += 1
+        # books added since the snapshot was written
+        while book_id in changes:
+            yield changes.pop(book_id)
+            book_id += 1
 
     def load_members(self):
-        with open(MEMBERS_FILE) as f:
-            for line in f:
-                member = Member.from_file(line)
+        with paused_gc(), open(self.members_file) as f:
+            members = {m.username: m for m in map(Member.from_file, f) if m}
+        for seq, key, rest in self.read_journal("M"):
+            member = Member.from_file(rest)
+            if member:
+                member.version = seq
+                members[key] = member
+                self.unsaved_members = True
+                if self.shared:
+                    self.versions["M", key] = seq
+        return list(members.values())
+
+    def write_atomic(self, path, write, mode="w"):
+        tmp = path + ".tmp"
+        with open(tmp, mode) as f:
+            write(f)
+            if self.durability != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def save_books(self, books):
+        if self.books_format == "binary":
+            self.write_atomic(
+                self.books_bin_file,
+                lambda f: write_binary_catalog(books, f), "wb"
+            )
+        else:
+            self.write_atomic(
+                self.books_file,
+                lambda f: f.writelines(b.to_file() for b in books)
+            )
+
+    def save_members(self, members):
+        self.write_atomic(
+            self.members_file,
+            lambda f: f.writelines(m.to_file() for m in members)
+        )
+
+    def write_records(self, op, items):
+        ts = datetime.now().isoformat()
+        for item in items:
+            self.journal_seq += 1
+            if isinstance(item, Book):
+                kind, key = "B", item.id
+                self.unsaved_books = True
+            else:
+                kind, key = "M", item.username
+                self.unsaved_members = True
+            self.journal.write(
+                f"{self.journal_seq}|{ts}|{op}|{kind}|{key}|{item.to_file()}"
+            )
+            item.version = self.journal_seq
+            if self.shared:
+                self.versions[kind, key] = self.journal_seq
+
+    # ---------- SHARED FILES ----------
+    def acquire(self):
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        # another process compacted, so the file we append to is gone
+        if (os.fstat(self.journal.fileno()).st_ino
+                != os.stat(self.journal_file).st_ino):
+            self.journal.close()
+            self.journal = open(self.journal_file, "a")
+            self.journal_replaced = True
+
+    def release(self):
+        # the other processes must see every line once the lock is free
+        if not self.journal.closed:
+            self.journal.flush()
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def tail(self):
+        if self.journal_replaced:
+            return None
+        with open(self.journal_file, "rb") as f:
+            f.seek(self.journal_offset)
+            data = f.read()
+        data = data[:data.rfind(b"\n") + 1]
+        self.journal_offset += len(data)
+        books, members = {}, {}
+        for line in data.decode().splitlines():
+            parts = line.split("|", 5)
+            if len(parts) != 6:
+                continue
+            seq = int(parts[0])
+            self.journal_seq = max(self.journal_seq, seq)
+            kind, key = parts[3], parts[4]
+            if kind == "B":
+                book = Book.from_file(parts[5])
+                if book:
+                    book.version = seq
+                    books[int(key)] = book
+                    self.versions[kind, int(key)] = seq
+                    self.unsaved_books = True
+            elif kind == "M":
+                member = Member.from_file(parts[5])
                 if member:
-                    self.members.append(member)
+                    member.version = seq
+                    members[key] = member
+                    self.versions[kind, key] = seq
+                    self.unsaved_members = True
+        return books, list(members.values())
 
-    def save_members(self):
-        with open(MEMBERS_FILE, "w") as f:
-            for m in self.members:
-                f.write(m.to_file())
+    def reset(self):
+        self.versions.clear()
+        self.unsaved_books = False
+        self.unsaved_members = False
+
+    # stale if a newer line for the record was seen, or is in the part of
+    # the journal not read yet
+    def check_versions(self, items):
+        if not self.shared:
+            return
+        versions = {record_key(item): item.version for item in items}
+        with open(self.journal_file, "rb") as f:
+            f.seek(self.journal_offset)
+            unread = f.read().decode().splitlines()
+        for line in unread:
+            parts = line.split("|", 5)
+            if len(parts) != 6 or parts[3] not in ("B", "M"):
+                continue
+            key = (parts[3], int(parts[4]) if parts[3] == "B" else parts[4])
+            if key in versions and int(parts[0]) > versions[key]:
+                raise StaleWrite(f"{key} was changed by another process")
+        for key, version in versions.items():
+            if self.versions.get(key, 0) > version:
+                raise StaleWrite(f"{key} was changed by another process")
+
+    def flush(self):
+        if self.journal.closed:
+            return
+        self.journal.flush()
+        if self.durability != "none":
+            os.fsync(self.journal.fileno())
+
+    def needs_compaction(self):
+        return self.journal_seq - self.journal_base >= JOURNAL_MAX_ENTRIES
+
+    def position(self):
+        return self.journal_seq
+
+    def changed_since(self, position=None, since=None):
+        self.sync()
+        books, members = set(), set()
+        with open(self.journal_file) as f:
+            for line in f:
+                parts = line.split("|", 5)
+                if len(parts) != 6 or not line.endswith("\n"):
+                    continue
+                seq, ts, op, kind, key = int(parts[0]), parts[1], *parts[2:5]
+                if op == "compact":
+                    # anything older was folded into the snapshot files
+                    if ((position is not None and position < seq)
+                            or (since and since < datetime.fromisoformat(ts))):
+                        return None
+                    continue
+                if position is not None and seq <= position:
+                    continue
+                if since and datetime.fromisoformat(ts) < since:
+                    continue
+                if kind == "B":
+                    books.add(int(key))
+                else:
+                    members.add(key)
+        return books, members
+
+    # returns how many snapshot rewrites were skipped because nothing changed
+    def compact(self, books, members):
+        skipped = 0
+        with self.lock:
+            if self.unsaved_books:
+                self.save_books(books)
+                self.unsaved_books = False
+            else:
+                skipped += 1
+            if self.unsaved_members:
+                self.save_members(members)
+                self.unsaved_members = False
+            else:
+                skipped += 1
+            if self.journal_seq > self.journal_base:
+                # the snapshots now hold everything, so pending entries can go
+                self.pending_ops = 0
+                self.journal.close()
+                marker = (
+                    f"{self.journal_seq}|{datetime.now().isoformat()}"
+                    f"|compact|-|-|\n"
+                )
+                self.write_atomic(self.journal_file, lambda f: f.write(marker))
+                self.journal = open(self.journal_file, "a")
+                self.journal_base = self.journal_seq
+                self.journal_offset = len(marker)
+        return skipped
+
+    def close(self):
+        super().close()
+        self.journal.close()
+        if self.shared:
+            self.lock_file.close()
+
+
+class SQLiteStorage(Storage):
+    # one row per record, so a borrow or return touches two rows
+    # Each row keeps the seq of the change that wrote it as its version. In
+    # shared mode a process holds a write transaction while it updates and
+    # catches up from the changes table.
+    def __init__(self, durability=DURABILITY, path=SQLITE_FILE,
+                 shared=SHARED_FILES):
+        super().__init__(durability, shared)
+        # last changes seq applied, and whether the write transaction is held
+        self.seen_seq = 0
+        self.held = False
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "PRAGMA synchronous="
+            + {"fsync": "FULL", "group": "NORMAL", "none": "OFF"}[durability]
+        )
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS books (
+                id INTEGER PRIMARY KEY, title TEXT, title_key TEXT,
+                author TEXT, is_borrowed INTEGER, due_date TEXT,
+                borrowed_by TEXT, version INTEGER DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS books_title ON books(title_key);
+            CREATE INDEX IF NOT EXISTS books_due ON books(due_date);
+            CREATE TABLE IF NOT EXISTS members (
+                username TEXT PRIMARY KEY, password TEXT, role TEXT,
+                books TEXT, failed_attempts INTEGER, lock_until TEXT,
+                version INTEGER DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT, op TEXT,
+                kind TEXT, key TEXT
+            );
+        """)
+        # databases created before rows had versions
+        for table in ("books", "members"):
+            columns = [r[1] for r in self.db.execute(f"PRAGMA table_info({table})")]
+            if "version" not in columns:
+                self.db.execute(
+                    f"ALTER TABLE {table} ADD COLUMN version INTEGER DEFAULT 0"
+                )
+        with self.exclusive():
+            self.setup_tables()
+
+    # A new database starts from the text files when there are any, so
+    # switching STORAGE to "sqlite" keeps an existing install's records.
+    def setup_tables(self):
+        if (not self.db.execute("SELECT 1 FROM members LIMIT 1").fetchone()
+                and os.path.exists(MEMBERS_FILE)):
+            self.import_text_files()
+        if not self.db.execute("SELECT 1 FROM members LIMIT 1").fetchone():
+            self.put_member(Member("admin", hash_password("admin123"), "admin"))
+        if not self.db.execute("SELECT 1 FROM books LIMIT 1").fetchone():
+            book = Book("AI for Beginners", "John Doe")
+            book.id = 0
+            self.put_book(book)
+        self.db.commit()
+
+    # the snapshot files with the journal applied; rows start at version 0
+    # like the rest of a new database
+    def import_text_files(self):
+        text = TextStorage("none", shared=False)
+        try:
+            for book_id, book in enumerate(text.load_books()):
+                book.id = book_id
+                book.version = 0
+                self.put_book(book)
+            for member in text.load_members():
+                member.version = 0
+                self.put_member(member)
+        finally:
+            text.close()
+
+    BOOK_COLUMNS = "title, author, is_borrowed, due_date, borrowed_by, version"
+    MEMBER_COLUMNS = (
+        "username, password, role, books, failed_attempts, lock_until, version"
+    )
+
+    @staticmethod
+    def book_from_row(row):
+        book = Book(row[0], row[1])
+        book.is_borrowed = bool(row[2])
+        book.due_date = datetime.fromisoformat(row[3]) if row[3] else None
+        book.borrowed_by = row[4]
+        book.version = row[5]
+        return book
+
+    @staticmethod
+    def member_from_row(row):
+        books = row[3].split(",") if row[3] else []
+        lock = datetime.fromisoformat(row[5]) if row[5] else None
+        member = Member(row[0], row[1], row[2], books, row[4], lock)
+        member.version = row[6]
+        return member
+
+    def load_books(self):
+        self.seen_seq = self.position()
+        return [
+            self.book_from_row(row) for row in self.db.execute(
+                f"SELECT {self.BOOK_COLUMNS} FROM books ORDER BY id"
+            )
+        ]
+
+    def load_members(self):
+        return [
+            self.member_from_row(row) for row in self.db.execute(
+                f"SELECT {self.MEMBER_COLUMNS} FROM members ORDER BY rowid"
+            )
+        ]
+
+    def put_book(self, book):
+        self.db.execute(
+            "INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET is_borrowed=excluded.is_borrowed, "
+            "due_date=excluded.due_date, borrowed_by=excluded.borrowed_by, "
+            "version=excluded.version",
+            (book.id, book.title, title_key(book.title), book.author,
+             int(book.is_borrowed),
+             str(book.due_date) if book.due_date else None, book.borrowed_by,
+             book.version),
+        )
+
+    def put_member(self, member):
+        self.db.execute(
+            "INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(username) DO UPDATE SET password=excluded.password, "
+            "role=excluded.role, books=excluded.books, "
+            "failed_attempts=excluded.failed_attempts, "
+            "lock_until=excluded.lock_until, version=excluded.version",
+            (member.username, member.password, member.role,
+             ",".join(member.books), member.failed_attempts,
+             str(member.lock_until) if member.lock_until else None,
+             member.version),
+        )
+
+    def save_books(self, books):
+        with self.lock:
+            self.db.execute("DELETE FROM books")
+            for book in books:
+                self.put_book(book)
+            self.db.commit()
+
+    def save_members(self, members):
+        with self.lock:
+            self.db.execute("DELETE FROM members")
+            for member in members:
+                self.put_member(member)
+            self.db.commit()
+
+    def write_records(self, op, items):
+        ts = datetime.now().isoformat()
+        for item in items:
+            kind, key = record_key(item)
+            item.version = self.db.execute(
+                "INSERT INTO changes (ts, op, kind, key) VALUES (?, ?, ?, ?)",
+                (ts, op, kind, str(key)),
+            ).lastrowid
+            if kind == "B":
+                self.put_book(item)
+            else:
+                self.put_member(item)
+
+    # ---------- SHARED FILES ----------
+    def acquire(self):
+        self.db.commit()
+        self.db.execute("BEGIN IMMEDIATE")
+        self.held = True
+
+    def release(self):
+        self.held = False
+        self.db.commit()
+
+    def tail(self):
+        rows = self.db.execute(
+            "SELECT seq, op, kind, key FROM changes WHERE seq > ? ORDER BY seq",
+            (self.seen_seq,),
+        ).fetchall()
+        if not rows:
+            return {}, []
+        self.seen_seq = rows[-1][0]
+        # the rows in between were trimmed by a compaction
+        if any(op == "compact" for _, op, _, _ in rows):
+            return None
+        books = {}
+        for book_id in {int(key) for _, _, kind, key in rows if kind == "B"}:
+            row = self.db.execute(
+                f"SELECT {self.BOOK_COLUMNS} FROM books WHERE id = ?", (book_id,)
+            ).fetchone()
+            if row:
+                books[book_id] = self.book_from_row(row)
+        members = []
+        for username in dict.fromkeys(key for _, _, kind, key in rows if kind == "M"):
+            row = self.db.execute(
+                f"SELECT {self.MEMBER_COLUMNS} FROM members WHERE username = ?",
+                (username,),
+            ).fetchone()
+            if row:
+                members.append(self.member_from_row(row))
+        return books, members
+
+    def check_versions(self, items):
+        if not self.shared:
+            return
+        for item in items:
+            kind, key = record_key(item)
+            if kind == "B":
+                row = self.db.execute(
+                    "SELECT version FROM books WHERE id = ?", (key,)
+                ).fetchone()
+            else:
+                row = self.db.execute(
+                    "SELECT version FROM members WHERE username = ?", (key,)
+                ).fetchone()
+            if row and row[0] != item.version:
+                raise StaleWrite(f"{(kind, key)} was changed by another process")
+
+    def position(self):
+        with self.lock:
+            return self.db.execute("SELECT MAX(seq) FROM changes").fetchone()[0] or 0
+
+    def changed_since(self, position=None, since=None):
+        with self.lock:
+            marker = self.db.execute(
+                "SELECT seq, ts FROM changes WHERE op = 'compact' "
+                "ORDER BY seq DESC LIMIT 1"
+            ).fetchone()
+            if marker and ((position is not None and position < marker[0])
+                           or (since and since < datetime.fromisoformat(marker[1]))):
+                return None
+            rows = self.db.execute(
+                "SELECT kind, key FROM changes WHERE seq > ? AND ts >= ? "
+                "AND op != 'compact'",
+                (position or 0, since.isoformat() if since else ""),
+            ).fetchall()
+        books = {int(key) for kind, key in rows if kind == "B"}
+        members = {key for kind, key in rows if kind == "M"}
+        return books, members
+
+    # in shared mode the transaction stays open until release()
+    def flush(self):
+        if not self.held:
+            self.db.commit()
+
+    # the rows are always current, so compaction only trims the change log
+    def compact(self, books, members):
+        with self.lock:
+            last = self.db.execute(
+                "SELECT seq, op FROM changes ORDER BY seq DESC LIMIT 1"
+            ).fetchone()
+            if last and last[1] != "compact":
+                self.db.execute("DELETE FROM changes")
+                self.db.execute(
+                    "INSERT INTO changes VALUES (?, ?, 'compact', '-', '-')",
+                    (last[0], datetime.now().isoformat()),
+                )
+                self.seen_seq = last[0]
+            self.flush()
+            self.pending_ops = 0
+            if not self.held:
+                self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return 0
+
+    def close(self):
+        super().close()
+        self.db.close()
+
+
+def open_storage(backend=STORAGE, durability=DURABILITY, shared=SHARED_FILES):
+    if backend == "text":
+        return TextStorage(durability, shared=shared)
+    if backend == "sqlite":
+        return SQLiteStorage(durability, shared=shared)
+    raise ValueError(f"unknown storage backend: {backend}")
+
+# ================= CONCURRENCY =================
+NO_LOCK = nullcontext()
+
+# raised for every change once the writer thread has failed to save one,
+# as the changes after it would be saved on top of a gap
+class WriteFailed(Exception):
+    def __init__(self, errors, dropped):
+        super().__init__(
+            f"saving stopped after {len(errors)} failed write(s), "
+            f"{dropped} more not saved: {errors[0]}"
+        )
+        self.errors = list(errors)
+        self.dropped = dropped
+
+# Runs storage calls one at a time on its own thread, in submission order.
+# The caller has already returned when a call runs, so after the first
+# failure nothing more is written and submit(), flush() and close() raise
+# WriteFailed with every error.
+class StorageWriter:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.errors = []
+        # calls skipped after a failure
+        self.dropped = 0
+        self.thread = threading.Thread(
+            target=self.run, name="library-writer", daemon=True
+        )
+        self.thread.start()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                if self.errors:
+                    self.dropped += 1
+                    continue
+                fn, args = job
+                fn(*args)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        if self.errors:
+            raise WriteFailed(self.errors, self.dropped)
+
+    def submit(self, fn, *args):
+        self.check()
+        self.queue.put((fn, args))
+
+    def flush(self):
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
+
+# a detached copy of a record, so the writer thread never sees a record
+# that another thread is half way through changing
+def record_copy(item):
+    if isinstance(item, Book):
+        copy = Book(item.title, item.author)
+        copy.is_borrowed = item.is_borrowed
+        copy.due_date = item.due_date
+        copy.borrowed_by = item.borrowed_by
+        copy.id = item.id
+        copy.version = item.version
+        return copy
+    copy = Member(item.username, item.password, item.role, list(item.books),
+                  item.failed_attempts, item.lock_until)
+    copy.version = item.version
+    return copy
+
+# runs a Library method as one update of the data files (Library.update)
+def shared_update(method):
+    @wraps(method)
+    def update(self, *args, **kwargs):
+        return self.update(method, self, *args, **kwargs)
+    return update
+
+# ================= LIBRARY =================
+class Library:
+    def __init__(self, storage=STORAGE, durability=DURABILITY,
+                 catalog=CATALOG_STORE, concurrent=CONCURRENT,
+                 shared=SHARED_FILES):
+        if isinstance(storage, str):
+            storage = open_storage(storage, durability, shared)
+        self.storage = storage
+        self.shared = storage.shared
+        self.concurrent = concurrent
+        if concurrent:
+            self.title_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+            self.member_locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+            # guards appends to the catalog and its indexes
+            self.catalog_lock = threading.RLock()
+            self.due_lock = threading.Lock()
+        else:
+            self.catalog_lock = self.due_lock = NO_LOCK
+        # shared files must be written before the cross-process lock is let go
+        self.writer = StorageWriter() if concurrent and not self.shared else None
+        # a snapshot rewrite is queued on the writer and has not run yet
+        self.compaction_pending = False
+        self.stats_lock = threading.Lock()
+        self.local = threading.local()
+        self.user_attempts = TokenBuckets(
+            MAX_LOGIN_ATTEMPTS, LOCK_MINUTES * 60 / MAX_LOGIN_ATTEMPTS
+        )
+        self.source_attempts = TokenBuckets(SOURCE_ATTEMPTS, SOURCE_REFILL_SECONDS)
+        self.sessions = SessionCache()
+        if catalog not in ("columnar", "objects"):
+            raise ValueError(f"unknown catalog store: {catalog}")
+        self.catalog = catalog
+        self.stats = {
+            "writes": 0, "writes_skipped": 0, "conflicts": 0, "reloads": 0,
+        }
+        self.reset()
+        with self.storage.exclusive():
+            self.load_books()
+            self.load_members()
+
+    def reset(self):
+        if self.catalog == "columnar":
+            self.books = ColumnarBooks(self)
+        else:
+            self.books = []
+        self.members = []
+        # title key -> book id for a single copy, otherwise
+        # ({available ids}, {borrowed ids}) with dicts used as ordered sets
+        self.title_index = {}
+        # username key -> Member; self.members keeps file order for saving
+        self.member_index = {}
+        # min-heap of (due date in epoch us, book id) for outstanding loans;
+        # returned loans are dropped lazily when they surface
+        self.due_queue = []
+        self.stale_due = 0
+        # search term -> array of ids of books with it in the title
+        # (title_terms) or the author (author_terms)
+        self.title_terms = {}
+        self.author_terms = {}
+        # distinct title keys for prefix completion; appended unsorted while
+        # loading and sorted on first use, kept sorted with insort after that
+        self.title_keys = []
+        self.title_keys_sorted = False
+
+    # ---------- PERSISTENCE ----------
+    def load_books(self):
+        mapped = self.catalog == "columnar" and self.storage.map_books()
+        if mapped:
+            catalog, changes = mapped
+            with catalog, paused_gc():
+                self.books.load_catalog(catalog)
+                self.index_loaded()
+            for book_id in sorted(changes):
+                self.apply_book(book_id, changes[book_id])
+            return
+        for book in self.storage.load_books():
+            self.index_book(book)
+
+    def load_members(self):
+        for member in self.storage.load_members():
+            self.add_member(member)
 
     def save_books(self):
-        with open(BOOKS_FILE, "w") as f:
-            for b in self.books:
-                f.write(b.to_file())
+        self.storage.save_books(self.books)
 
-    def find_member(self, username):
-        for m in self.members:
-            if m.username == username:
-                return m
+    def save_members(self):
+        self.storage.save_members(self.members)
+
+    # ---------- LOCKING ----------
+    def title_lock(self, title):
+        if not self.concurrent:
+            return NO_LOCK
+        return self.title_locks[hash(title_key(title)) % LOCK_STRIPES]
+
+    def member_lock(self, username):
+        if not self.concurrent:
+            return NO_LOCK
+        return self.member_locks[hash(username_key(username)) % LOCK_STRIPES]
+
+    def count(self, **counts):
+        with self.stats_lock:
+            for name, n in counts.items():
+                self.stats[name] += n
+
+    # storage calls go through the writer thread in concurrent mode
+    def persist(self, fn, *args):
+        if self.writer:
+            self.writer.submit(fn, *args)
+        else:
+            fn(*args)
+
+    # ---------- SHARED FILES ----------
+    # Holds the storage's cross-process lock for the outermost block on this
+    # thread, after applying what other processes changed since last time.
+    @contextmanager
+    def files_locked(self):
+        if not self.shared or getattr(self.local, "updating", False):
+            yield
+            return
+        self.local.updating = True
+        try:
+            with self.storage.exclusive():
+                self.catch_up()
+                yield
+        finally:
+            self.local.updating = False
+
+    # A StaleWrite means a record changed on disk after it was read here,
+    # so nothing was written; the state is loaded again and the operation
+    # runs again on it.
+    def update(self, operation, *args, **kwargs):
+        # refuse a change up front once the writer thread has failed
+        if self.writer:
+            self.writer.check()
+        if not self.shared or getattr(self.local, "updating", False):
+            return operation(*args, **kwargs)
+        for _ in range(SHARED_RETRIES):
+            with self.files_locked():
+                try:
+                    return operation(*args, **kwargs)
+                except StaleWrite:
+                    self.count(conflicts=1)
+                    self.reload()
+        raise StaleWrite(f"gave up after {SHARED_RETRIES} attempts")
+
+    def catch_up(self):
+        changes = self.storage.tail()
+        if changes is None:
+            self.reload()
+            return
+        books, members = changes
+        # ids are positions, so books added elsewhere must go in id order
+        for book_id in sorted(books):
+            self.apply_book(book_id, books[book_id])
+        for member in members:
+            self.apply_member(member)
+
+    def apply_book(self, book_id, stored):
+        if book_id >= len(self.books):
+            self.index_book(stored)
+            return
+        book = self.books[book_id]
+        if stored.version <= book.version:
+            return
+        if book.is_borrowed:
+            self.book_returned(book)
+        book.is_borrowed = stored.is_borrowed
+        book.due_date = stored.due_date
+        book.borrowed_by = stored.borrowed_by
+        book.version = stored.version
+        book.dirty = False
+        if book.is_borrowed:
+            self.book_borrowed(book)
+
+    def apply_member(self, stored):
+        member = self.find_member(stored.username)
+        if member is None:
+            self.add_member(stored)
+        elif stored.version > member.version:
+            if stored.password != member.password:
+                self.sessions.revoke_member(member.username)
+            member.load_state(stored)
+
+    # everything from storage again; Member objects that callers hold stay
+    # valid because they are updated in place
+    def reload(self):
+        members = self.member_index
+        self.reset()
+        self.storage.reset()
+        self.load_books()
+        for stored in self.storage.load_members():
+            member = members.get(username_key(stored.username))
+            if member:
+                if stored.password != member.password:
+                    self.sessions.revoke_member(member.username)
+                member.load_state(stored)
+                stored = member
+            self.add_member(stored)
+        self.count(reloads=1)
+
+    # brings in other processes' changes before a read
+    def refresh(self):
+        with self.files_locked():
+            pass
+
+    # (kind, key) -> (op, record) while this thread has a batch open
+    @property
+    def batch_entries(self):
+        return getattr(self.local, "batch", None)
+
+    @batch_entries.setter
+    def batch_entries(self, entries):
+        self.local.batch = entries
+
+    # only dirty records are written; clean ones are counted as skipped
+    def record(self, op, *items):
+        changed = [item for item in items if item.dirty]
+        skipped = len(items) - len(changed)
+        if self.batch_entries is not None:
+            for item in changed:
+                key = record_key(item)
+                if key in self.batch_entries:
+                    skipped += 1
+                self.batch_entries[key] = (op, item)
+            self.count(writes_skipped=skipped)
+            return
+        for item in changed:
+            item.dirty = False
+        if changed:
+            if self.writer:
+                changed = [record_copy(item) for item in changed]
+            self.persist(self.storage.write, op, changed)
+        self.count(writes=len(changed), writes_skipped=skipped)
+        if changed:
+            self.compact_if_due()
+
+    # collects the records changed inside the block and persists each of
+    # them once, with a single commit, when the block ends
+    @contextmanager
+    def batch(self):
+        if self.batch_entries is not None:
+            yield
+            return
+        with self.files_locked():
+            self.batch_entries = {}
+            try:
+                yield
+            finally:
+                entries = list(self.batch_entries.values())
+                self.batch_entries = None
+                if entries:
+                    for _, item in entries:
+                        item.dirty = False
+                    if self.writer:
+                        entries = [
+                            (op, record_copy(item)) for op, item in entries
+                        ]
+                    self.persist(self.storage.write_batch, entries)
+                    self.count(writes=len(entries))
+                    self.compact_if_due()
+
+    # With a writer thread the journal still counts the writes it has not
+    # applied, and a rewrite already queued has not cut it back yet, so no
+    # second rewrite is queued behind a pending one.
+    def compact_if_due(self):
+        if not self.compaction_pending and self.storage.needs_compaction():
+            self.compact(wait=False)
+
+    @shared_update
+    def compact(self, wait=True):
+        if self.writer:
+            self.compaction_pending = True
+        self.persist(self.compact_storage)
+        if wait:
+            self.sync()
+
+    def compact_storage(self):
+        try:
+            self.count(
+                writes_skipped=self.storage.compact(self.books, self.members)
+            )
+        finally:
+            self.compaction_pending = False
+
+    def sync(self):
+        if self.writer:
+            self.writer.flush()
+        self.storage.sync()
+
+    def close(self):
+        try:
+            if self.writer:
+                self.writer.close()
+        finally:
+            self.storage.close()
+
+    # ---------- TITLE INDEX ----------
+    # returns the stored book, which is a BookView for a columnar catalog
+    def index_book(self, book):
+        book.id = len(self.books)
+        book.library = self
+        self.books.append(book)
+        book = self.books[book.id]
+        self.index_title(book.id, book.title, book.is_borrowed)
+        self.index_terms(book.id, book.title, book.author)
+        if book.is_borrowed and book.due_date:
+            with self.due_lock:
+                heapq.heappush(
+                    self.due_queue, (to_epoch_us(book.due_date), book.id)
+                )
+        return book
+
+    # the indexes for a columnar catalog just loaded whole, read from its
+    # columns without a BookView per row
+    def index_loaded(self):
+        store = self.books
+        strings, author_ids = store.strings, store.author_ids
+        borrowed, due = store.borrowed, store.due
+        title_terms = self.title_terms
+        # authors repeat, so each one is tokenized once: author id -> the
+        # postings of its terms
+        by_author = {}
+        for book_id, title in enumerate(store.titles):
+            self.index_title(book_id, title, borrowed[book_id])
+            for term in set(tokenize(title)):
+                postings = title_terms.get(term)
+                if postings is None:
+                    postings = title_terms[term] = array("I")
+                postings.append(book_id)
+            author = author_ids[book_id]
+            author_postings = by_author.get(author)
+            if author_postings is None:
+                author_postings = by_author[author] = [
+                    self.author_terms.setdefault(term, array("I"))
+                    for term in set(tokenize(strings[author]))
+                ]
+            for postings in author_postings:
+                postings.append(book_id)
+        self.due_queue = [
+            (due[i], i) for i in range(len(store))
+            if borrowed[i] and due[i] != NO_DATE
+        ]
+        heapq.heapify(self.due_queue)
+
+    def index_title(self, book_id, title, is_borrowed):
+        key = title_key(title)
+        entry = self.title_index.get(key)
+        if entry is None:
+            # most titles have one copy; its id alone is enough, the book
+            # itself says whether it is borrowed
+            self.title_index[key] = book_id
+            if self.title_keys_sorted:
+                insort(self.title_keys, key)
+            else:
+                self.title_keys.append(key)
+            return
+        if isinstance(entry, int):
+            first = entry
+            entry = self.title_index[key] = ({}, {})
+            entry[self.books[first].is_borrowed][first] = None
+        entry[bool(is_borrowed)][book_id] = None
+
+    def book_borrowed(self, book):
+        with self.due_lock:
+            heapq.heappush(self.due_queue, (to_epoch_us(book.due_date), book.id))
+        entry = self.title_index[title_key(book.title)]
+        if not isinstance(entry, int):
+            entry[0].pop(book.id, None)
+            entry[1][book.id] = None
+
+    def book_returned(self, book):
+        with self.due_lock:
+            self.stale_due += 1
+            if self.stale_due > 64 and self.stale_due * 2 > len(self.due_queue):
+                self.rebuild_due_queue()
+        entry = self.title_index[title_key(book.title)]
+        if not isinstance(entry, int):
+            entry[1].pop(book.id, None)
+            entry[0][book.id] = None
+
+    # ids of every copy of a title, available copies first
+    def title_copies(self, title):
+        entry = self.title_index.get(title_key(title))
+        if entry is None:
+            return ()
+        if isinstance(entry, int):
+            return (entry,)
+        return (*entry[0], *entry[1])
+
+    def find_available(self, title):
+        entry = self.title_index.get(title_key(title))
+        if isinstance(entry, int):
+            book = self.books[entry]
+            return None if book.is_borrowed else book
+        if entry and entry[0]:
+            return self.books[next(iter(entry[0]))]
         return None
 
+    # ids of the borrowed copies of a title, plus a single copy whether or
+    # not it is borrowed
+    def borrowed_ids(self, title):
+        entry = self.title_index.get(title_key(title))
+        return (entry,) if isinstance(entry, int) else entry[1] if entry else ()
+
+    def find_borrowed(self, title, username):
+        for book_id in self.borrowed_ids(title):
+            book = self.books[book_id]
+            if book.borrowed_by == username:
+                return book
+        return None
+
+    # ---------- SEARCH ----------
+    def index_terms(self, book_id, title, author):
+        for term in set(tokenize(title)):
+            postings = self.title_terms.get(term)
+            if postings is None:
+                postings = self.title_terms[term] = array("I")
+            postings.append(book_id)
+        for term in set(tokenize(author)):
+            postings = self.author_terms.get(term)
+            if postings is None:
+                postings = self.author_terms[term] = array("I")
+            postings.append(book_id)
+
+    # books matching every term of the query in their title or author,
+    # ranked by exact title match, then title hits over author hits
+    def search(self, query, limit=SEARCH_LIMIT):
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        postings = sorted(
+            ((self.title_terms.get(t, ()), self.author_terms.get(t, ()))
+             for t in terms),
+            key=lambda p: len(p[0]) + len(p[1]),
+        )
+        exact = sorted(self.title_copies(query))[:limit]
+        wanted = limit - len(exact)
+        # Only books with the rarest term can match. They are walked in id
+        # order and every term is looked up by binary search in its
+        # postings, which are sorted by id. Ties go to the lower id, so the
+        # walk stops once enough books have every term in the title.
+        best = 2 * len(terms)
+        found = []
+        last = None
+        for book_id in heapq.merge(*postings[0]):
+            if wanted <= 0:
+                break
+            if book_id == last or book_id in exact:
+                continue
+            last = book_id
+            score = len(terms)
+            for in_title, in_author in postings:
+                if sorted_contains(in_title, book_id):
+                    score += 1
+                elif not sorted_contains(in_author, book_id):
+                    break
+            else:
+                found.append((-score, book_id))
+                if score == best:
+                    wanted -= 1
+        ranked = heapq.nsmallest(limit - len(exact), found)
+        top = exact + [book_id for _, book_id in ranked]
+        return [self.books[book_id] for book_id in top]
+
+    # ---------- LISTING ----------
+    # books from id start onward, in catalog order, matching every filter
+    # given: available, borrowed_by (username), author, overdue. The
+    # overdue heap or the member's loans narrow down the ids to look at;
+    # each book is then checked against all of the filters.
+    def iter_books(self, start=0, available=None, borrowed_by=None,
+                   author=None, overdue=False, now=None):
+        now = now or datetime.now()
+        if overdue:
+            ids = sorted(b.id for b in self.overdue_loans(now))
+        elif borrowed_by is not None:
+            member = self.find_member(borrowed_by)
+            ids = sorted({
+                book_id for t in set(member.books if member else ())
+                for book_id in self.borrowed_ids(t)
+            })
+        else:
+            ids = None
+        if ids is not None:
+            ids = ids[bisect_left(ids, start):]
+        else:
+            ids = range(start, len(self.books))
+        borrower = borrowed_by is not None and username_key(borrowed_by)
+        author_key = author and author.casefold()
+        for book_id in ids:
+            b = self.books[book_id]
+            if available is not None and b.is_borrowed == available:
+                continue
+            if borrowed_by is not None and not (
+                    b.is_borrowed and username_key(b.borrowed_by) == borrower):
+                continue
+            if overdue and not (b.is_borrowed and b.due_date and b.due_date < now):
+                continue
+            if author_key and b.author.casefold() != author_key:
+                continue
+            yield b
+
+    # one page of iter_books and the cursor for the next page (None at the end)
+    def list_books(self, cursor=0, limit=PAGE_SIZE, **filters):
+        page = []
+        for b in self.iter_books(cursor, **filters):
+            if len(page) == limit:
+                return page, b.id
+            page.append(b)
+        return page, None
+
+    # ---------- COMPLETION ----------
+    # up to limit titles starting with prefix (case-insensitive); with
+    # available_only only titles with a free copy, with member only titles
+    # that member has on loan
+    def complete_title(self, prefix, limit=COMPLETION_LIMIT,
+                       available_only=False, member=None):
+        key = title_key(prefix)
+        if member:
+            loans = sorted({t for t in member.books if title_key(t).startswith(key)})
+            return loans[:limit]
+        if not self.title_keys_sorted:
+            with self.catalog_lock:
+                if not self.title_keys_sorted:
+                    self.title_keys.sort()
+                    self.title_keys_sorted = True
+        keys = self.title_keys
+        found = []
+        i = bisect_left(keys, key)
+        while i < len(keys) and len(found) < limit and keys[i].startswith(key):
+            if available_only:
+                book = self.find_available(keys[i])
+            else:
+                book = self.books[self.title_copies(keys[i])[0]]
+            if book:
+                found.append(book.title)
+            i += 1
+        return found
+
+    # ---------- DUE DATES ----------
+    def live_due(self, entry):
+        book = self.books[entry[1]]
+        return book.is_borrowed and to_epoch_us(book.due_date) == entry[0]
+
+    def rebuild_due_queue(self):
+        self.due_queue = [e for e in self.due_queue if self.live_due(e)]
+        heapq.heapify(self.due_queue)
+        self.stale_due = 0
+
+    # loans due before limit, soonest first; walks only the part of the heap
+    # above the limit, so the cost follows the number of results
+    def loans_due_before(self, limit):
+        limit_us = to_epoch_us(limit)
+        found = []
+        stack = [0]
+        with self.due_lock:
+            heap = self.due_queue
+            while stack:
+                i = stack.pop()
+                if i >= len(heap) or heap[i][0] >= limit_us:
+                    continue
+                if self.live_due(heap[i]):
+                    found.append(heap[i])
+                stack.append(2 * i + 1)
+                stack.append(2 * i + 2)
+        found.sort()
+        return [self.books[book_id] for _, book_id in found]
+
+    def overdue_loans(self, now=None):
+        return self.loans_due_before(now or datetime.now())
+
+    def loans_due_soon(self, hours=REMINDER_HOURS, now=None):
+        now = now or datetime.now()
+        return [
+            b for b in self.loans_due_before(now + timedelta(hours=hours))
+            if b.due_date >= now
+        ]
+
+    def outstanding_fines(self, now=None):
+        return fine_totals(self.books, now)
+
+    # ---------- MEMBER REGISTRY ----------
+    def add_member(self, member):
+        self.members.append(member)
+        self.member_index[username_key(member.username)] = member
+
+    def find_member(self, username):
+        return self.member_index.get(username_key(username))
+
     # ---------- AUTH ----------
-    def login(self):
-        u = input("Username: ")
-        m = self.find_member(u)
+    # Passwords are hashed on the calling thread before any lock is taken;
+    # hashlib releases the GIL, so logins on other threads hash in parallel.
+    # The locked step then checks the stored hash is still the one that
+    # was verified, and returns None to start over if it changed meanwhile.
+
+    # source identifies the client (an address) for per-source throttling
+    def login(self, username, password, source=None):
+        wait = self.source_attempts.wait(source) if source else 0
+        if wait:
+            return failure(
+                "throttled",
+                f"⏳ Too many failed logins. Try again in {math.ceil(wait)} second(s)"
+            )
+        while True:
+            m = self.find_member(username)
+            if not m and self.shared:
+                self.refresh()
+                m = self.find_member(username)
+
+            if not m:
+                if source:
+                    self.source_attempts.take(source)
+                return failure("not_found", "❌ User not found")
+
+            if m.is_locked():
+                return self.locked_out(m)
+
+            stored = m.password
+            ok = verify_password(password, stored)
+            rehashed = None
+            if ok and needs_rehash(stored):
+                rehashed = hash_password(password)
+            result = self.check_login(m, stored, ok, rehashed, source)
+            if result is not None:
+                return result
+
+    def locked_out(self, m):
+        return failure(
+            "locked",
+            f"🔒 Account locked. Try again in "
+            f"{m.lock_remaining_minutes()} minute(s)"
+        )
+
+    # Only lock transitions are written: a failed attempt is counted in
+    # memory and the member is saved when it gets locked or unlocked.
+    @shared_update
+    def check_login(self, m, stored, ok, rehashed, source=None):
+        key = username_key(m.username)
+        with self.member_lock(m.username):
+            if m.password != stored:
+                return None
+
+            if m.is_locked():
+                return self.locked_out(m)
+
+            if ok:
+                self.user_attempts.clear(key)
+                m.reset_login_state()
+                # upgrade a legacy or outdated hash while the password is known
+                if rehashed:
+                    m.set_password(rehashed)
+                self.record("login", m)
+                return success(
+                    f"✅ Login successful ({m.role})",
+                    member=m, token=self.sessions.create(m),
+                )
+
+            # WRONG PASSWORD
+            if source:
+                self.source_attempts.take(source)
+            # attempts counted before this process started, unless they
+            # already ended in a lock that has since run out
+            used = 0 if m.lock_until else m.failed_attempts
+            left = self.user_attempts.take(key, used=used)
+            if left < 1:
+                self.user_attempts.clear(key)
+                m.lock_out()
+                self.record("lockout", m)
+                return failure(
+                    "locked", f"🔒 Account locked for {LOCK_MINUTES} minutes"
+                )
+        return failure(
+            "wrong_password",
+            f"❌ Wrong password "
+            f"({MAX_LOGIN_ATTEMPTS - math.floor(left)}/{MAX_LOGIN_ATTEMPTS})"
+        )
+
+    def register(self, username, password):
+        if not valid_field(username):
+            return failure("invalid", "❌ Invalid username")
+        if self.find_member(username):
+            return failure("exists", "❌ Username exists")
+        return self.add_registered(username, hash_password(password))
+
+    @shared_update
+    def add_registered(self, username, hashed):
+        with self.member_lock(username):
+            if self.find_member(username):
+                return failure("exists", "❌ Username exists")
+            m = Member(username, hashed)
+            m.dirty = True
+            with self.catalog_lock:
+                self.add_member(m)
+            self.record("register", m)
+        return success(
+            "✅ Registered successfully", member=m, token=self.sessions.create(m)
+        )
+
+    def change_password(self, member, old, new):
+        while True:
+            stored = member.password
+            if not verify_password(old, stored):
+                result = self.set_password(member, stored, None)
+            else:
+                result = self.set_password(member, stored, hash_password(new))
+            if result is not None:
+                return result
+
+    @shared_update
+    def set_password(self, member, stored, hashed):
+        with self.member_lock(member.username):
+            if member.password != stored:
+                return None
+            if hashed is None:
+                return failure("wrong_password", "❌ Wrong old password")
+            member.set_password(hashed)
+            self.record("password", member)
+        # signed out everywhere else; the caller gets a fresh token
+        self.sessions.revoke_member(member.username)
+        return success("✅ Password changed", token=self.sessions.create(member))
+
+    # ---------- SESSIONS ----------
+    # the member a login token belongs to, or None once it is unknown,
+    # idle too long or revoked
+    def authorize(self, token):
+        return self.sessions.get(token)
+
+    def logout(self, token):
+        self.sessions.revoke(token)
+
+    # ---------- OPERATIONS ----------
+    @shared_update
+    def add_book(self, title, author):
+        if not valid_field(title) or not valid_field(author):
+            return failure("invalid", "❌ Invalid title or author")
+        book = Book(title, author)
+        book.dirty = True
+        with self.title_lock(title), self.catalog_lock:
+            book = self.index_book(book)
+        self.record("add_book", book)
+        return success("✅ Book added", book=book)
+
+    # locks are always taken member first, then title
+    @shared_update
+    def borrow_book(self, member, title):
+        with self.member_lock(member.username), self.title_lock(title):
+            if not member.can_borrow():
+                return failure("limit", "❌ Maximum books reached")
+            b = self.find_available(title)
+            if not b:
+                return failure("unavailable", "❌ Book not available")
+            b.borrow(member)
+            member.add_loan(b.title)
+            self.record("borrow", b, member)
+        return success("✅ Book borrowed", book=b)
+
+    @shared_update
+    def return_book(self, member, title):
+        with self.member_lock(member.username), self.title_lock(title):
+            b = self.find_borrowed(title, member.username)
+            if not b:
+                return failure("not_found", "❌ Book not found")
+            fine = b.fine()
+            b.return_book()
+            member.remove_loan(b.title)
+            self.record("return", b, member)
+        return success(f"✅ Returned | Fine: {fine} TZS", book=b, fine=fine)
+
+    # ---------- BULK ----------
+    # Each takes a list of items and returns one Result per item; the
+    # changes are persisted together when the whole list has been applied.
+    def borrow_many(self, pairs):
+        return self.apply_many(self.borrow_book, pairs)
+
+    def return_many(self, pairs):
+        return self.apply_many(self.return_book, pairs)
+
+    @shared_update
+    def add_books(self, books):
+        with self.batch():
+            return [self.add_book(title, author) for title, author in books]
+
+    # pairs are (member or username, title)
+    @shared_update
+    def apply_many(self, operation, pairs):
+        results = []
+        with self.batch():
+            for member, title in pairs:
+                if isinstance(member, str):
+                    member = self.find_member(member)
+                if member:
+                    results.append(operation(member, title))
+                else:
+                    results.append(failure("not_found", "❌ User not found"))
+        return results
+
+# ================= IMPORT =================
+# import_books streams a CSV (with a title,author header) or JSON Lines
+# file through parse -> validate -> dedupe -> add, one batch per chunk,
+# so memory stays flat however long the file is.
+def parse_rows(path, stats):
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if not line.strip():
+                    continue
+                stats["rows"] += 1
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    stats["invalid"] += 1
+                    continue
+                if isinstance(row, dict):
+                    yield row
+                else:
+                    stats["invalid"] += 1
+        else:
+            for row in csv.DictReader(f):
+                stats["rows"] += 1
+                yield row
+
+def validate_rows(rows, stats):
+    for row in rows:
+        row = {str(k).strip().lower(): v for k, v in row.items() if k}
+        title = str(row.get("title") or "").strip()
+        author = str(row.get("author") or "").strip()
+        if valid_field(title) and valid_field(author):
+            yield title, author
+        else:
+            stats["invalid"] += 1
+
+# a row is a duplicate when a copy with the same title and author exists
+def dedupe_rows(library, rows, stats):
+    for title, author in rows:
+        if any(library.books[i].author == author
+               for i in library.title_copies(title)):
+            stats["duplicates"] += 1
+        else:
+            yield title, author
+
+def import_books(library, path, chunk=IMPORT_CHUNK):
+    stats = {"rows": 0, "added": 0, "duplicates": 0, "invalid": 0}
+    start = time.perf_counter()
+    rows = dedupe_rows(library, validate_rows(parse_rows(path, stats), stats), stats)
+    while True:
+        added = 0
+        with library.batch():
+            for title, author in islice(rows, chunk):
+                library.add_book(title, author)
+                added += 1
+        stats["added"] += added
+        if added < chunk:
+            break
+    stats["seconds"] = time.perf_counter() - start
+    stats["rows_per_second"] = int(stats["rows"] / max(stats["seconds"], 1e-9))
+    return stats
+
+# ================= EXPORT =================
+# export_records streams books, members (without password hashes) or
+# active loans to CSV or JSON Lines one row at a time. With since (a
+# storage position, or a datetime) only records changed after it are
+# written; if the storage no longer has that history everything is. An
+# incremental loans export also has an on_loan=false row for each changed
+# book that is not lent out, so loans exported earlier can be closed.
+EXPORT_FIELDS = {
+    "books": ("id", "title", "author", "is_borrowed", "due_date", "borrowed_by"),
+    "members": ("username", "role", "books", "failed_attempts", "lock_until"),
+    "loans": ("book_id", "title", "borrowed_by", "due_date", "on_loan"),
+}
+
+def iso(dt):
+    return dt.isoformat() if dt else None
+
+def export_rows(library, what, changed):
+    if what == "members":
+        members = library.members
+        if changed is not None:
+            members = (library.find_member(u) for u in sorted(changed[1]))
+        for m in members:
+            if m:
+                yield {"username": m.username, "role": m.role,
+                       "books": ",".join(m.books),
+                       "failed_attempts": m.failed_attempts,
+                       "lock_until": iso(m.lock_until)}
+        return
+    books = library.books
+    if changed is not None:
+        books = (library.books[i] for i in sorted(changed[0]) if i < len(library.books))
+    for b in books:
+        if what == "books":
+            yield {"id": b.id, "title": b.title, "author": b.author,
+                   "is_borrowed": b.is_borrowed, "due_date": iso(b.due_date),
+                   "borrowed_by": b.borrowed_by}
+        elif b.is_borrowed or changed is not None:
+            yield {"book_id": b.id, "title": b.title,
+                   "borrowed_by": b.borrowed_by, "due_date": iso(b.due_date),
+                   "on_loan": b.is_borrowed}
+
+def export_records(library, path, what="books", since=None):
+    if what not in EXPORT_FIELDS:
+        raise ValueError(f"unknown export: {what}")
+    if library.writer:
+        library.writer.flush()
+    library.refresh()
+    # taken first: a change made while this runs is then exported again
+    # next time rather than never
+    position = library.storage.position()
+    changed = None
+    if since is not None:
+        if isinstance(since, datetime):
+            changed = library.storage.changed_since(since=since)
+        else:
+            changed = library.storage.changed_since(position=since)
+    rows = export_rows(library, what, changed)
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+                count += 1
+        else:
+            writer = csv.DictWriter(f, EXPORT_FIELDS[what])
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    return {"rows": count, "position": position,
+            "incremental": changed is not None}
+
+# ================= SERVICE =================
+# A small HTTP/JSON service for kiosks (stdlib asyncio, keep-alive, one
+# JSON object per request and response). Login and register return a
+# session token; send it as "Authorization: Bearer <token>", or keep using
+# the connection, which remembers the last token it was given:
+#   POST /login, /register {username, password}   POST /logout
+#   GET /search?q=..   GET /books?cursor=..&limit=..   GET /stats
+#   POST /borrow, /return {title}   POST /password {old, new}
+# Library calls run on a thread pool, so hashing never holds up the event
+# loop, and the library runs in concurrent mode, so its writer thread does
+# the file writes.
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized",
+                404: "Not Found", 500: "Internal Server Error"}
+
+def book_json(book):
+    return {
+        "id": book.id, "title": book.title, "author": book.author,
+        "available": not book.is_borrowed, "due_date": iso(book.due_date),
+    }
+
+def result_json(result):
+    payload = {"ok": result.ok, "code": result.code, "message": result.message}
+    if "book" in result.data:
+        payload["book"] = book_json(result.data["book"])
+    if "fine" in result.data:
+        payload["fine"] = result.data["fine"]
+    if "token" in result.data:
+        payload["token"] = result.data["token"]
+    if "member" in result.data:
+        member = result.data["member"]
+        payload["member"] = {
+            "username": member.username, "role": member.role,
+            "books": member.books,
+        }
+    return payload
+
+# Request fields come from client JSON, so they are checked here before
+# they reach the library; a TypeError or ValueError becomes a 400 reply.
+def text_param(params, name):
+    value = params[name]
+    if not isinstance(value, str):
+        raise TypeError(f"Field '{name}' must be a string")
+    return value
+
+def number_param(params, name, default):
+    value = params.get(name, default)
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError(f"Field '{name}' must be a whole number")
+    return value
+
+def limit_param(params, default):
+    return max(1, min(number_param(params, "limit", default), SERVICE_MAX_LIMIT))
+
+def http_message(start_line, headers, payload):
+    body = json.dumps(payload).encode()
+    head = [start_line, f"Content-Length: {len(body)}"]
+    head += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(head) + "\r\n\r\n").encode() + body
 
-        if not m:
-            print("❌ User not found")
+# (start line, headers, raw body), or None once the peer is gone
+async def read_http(reader):
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    headers = {}
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = header.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return line.decode().strip(), headers, body
+
+class LibraryService:
+    def __init__(self, library, workers=SERVICE_WORKERS):
+        self.library = library
+        self.pool = ThreadPoolExecutor(workers)
+        self.stats = {"connections": 0, "requests": 0, "errors": 0}
+        self.routes = {
+            ("POST", "/login"): self.login,
+            ("POST", "/register"): self.register,
+            ("POST", "/logout"): self.logout,
+            ("GET", "/search"): self.search,
+            ("GET", "/books"): self.books,
+            ("POST", "/borrow"): self.borrow,
+            ("POST", "/return"): self.return_book,
+            ("POST", "/password"): self.change_password,
+            ("GET", "/stats"): self.show_stats,
+        }
+
+    async def serve(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"📡 Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    def run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    async def handle(self, reader, writer):
+        self.stats["connections"] += 1
+        peer = writer.get_extra_info("peername")
+        session = {"token": None, "member": None,
+                   "source": peer[0] if peer else None}
+        try:
+            while True:
+                request = await read_http(reader)
+                if request is None:
+                    break
+                start_line, headers, body = request
+                status, payload = await self.dispatch(
+                    session, start_line, headers, body
+                )
+                writer.write(http_message(
+                    f"HTTP/1.1 {status} {HTTP_REASONS[status]}",
+                    {"Content-Type": "application/json"}, payload,
+                ))
+                await writer.drain()
+                if headers.get("connection") == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            self.stats["errors"] += 1
+        finally:
+            writer.close()
+
+    async def dispatch(self, session, start_line, headers, body):
+        self.stats["requests"] += 1
+        auth = headers.get("authorization", "")
+        if auth.startswith("Bearer "):
+            session["token"] = auth[len("Bearer "):]
+        # one dict lookup: no hashing and nothing written
+        session["member"] = (
+            self.library.authorize(session["token"]) if session["token"] else None
+        )
+        parts = start_line.split(" ")
+        if len(parts) != 3:
+            return 400, {"ok": False, "code": "bad_request",
+                         "message": "❌ Malformed request line"}
+        method, target, _ = parts
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if not handler:
+            return 404, {"ok": False, "code": "not_found", "message": "❌ No such endpoint"}
+        try:
+            # a body that is not JSON, or not an object, is the client's mistake
+            params = json.loads(body) if body else {}
+            if not isinstance(params, dict):
+                raise TypeError("Request body must be a JSON object")
+            params.update((k, v[-1]) for k, v in parse_qs(url.query).items())
+            return await handler(session, params)
+        except KeyError as e:
+            return 400, {"ok": False, "code": "bad_request",
+                         "message": f"❌ Missing field {e}"}
+        except (TypeError, ValueError) as e:
+            return 400, {"ok": False, "code": "bad_request", "message": f"❌ {e}"}
+        except Exception as e:
+            self.stats["errors"] += 1
+            return 500, {"ok": False, "code": "error", "message": f"❌ {e}"}
+
+    def reply(self, result):
+        return (200 if result.ok else 400), result_json(result)
+
+    def signed_in(self, session):
+        if session["member"]:
             return None
+        return 401, {"ok": False, "code": "login", "message": "❌ Login first"}
+
+    async def login(self, session, params):
+        result = await self.run(
+            self.library.login, text_param(params, "username"),
+            text_param(params, "password"), session["source"],
+        )
+        if result.ok:
+            session["token"] = result.data["token"]
+        return self.reply(result)
+
+    async def register(self, session, params):
+        result = await self.run(
+            self.library.register, text_param(params, "username"),
+            text_param(params, "password"),
+        )
+        if result.ok:
+            session["token"] = result.data["token"]
+        return self.reply(result)
+
+    async def logout(self, session, params):
+        if session["token"]:
+            self.library.logout(session["token"])
+        session["token"] = None
+        return self.reply(success("👋 Logged out"))
+
+    # read-only and quick, so these stay on the event loop
+    async def search(self, session, params):
+        books = self.library.search(
+            text_param(params, "q"), limit_param(params, SEARCH_LIMIT)
+        )
+        return 200, {"ok": True, "books": [book_json(b) for b in books]}
+
+    async def books(self, session, params):
+        page, cursor = self.library.list_books(
+            max(0, number_param(params, "cursor", 0)), limit_param(params, PAGE_SIZE)
+        )
+        return 200, {"ok": True, "books": [book_json(b) for b in page],
+                     "cursor": cursor}
+
+    async def borrow(self, session, params):
+        denied = self.signed_in(session)
+        if denied:
+            return denied
+        return self.reply(await self.run(
+            self.library.borrow_book, session["member"], text_param(params, "title")
+        ))
+
+    async def return_book(self, session, params):
+        denied = self.signed_in(session)
+        if denied:
+            return denied
+        return self.reply(await self.run(
+            self.library.return_book, session["member"], text_param(params, "title")
+        ))
+
+    async def change_password(self, session, params):
+        denied = self.signed_in(session)
+        if denied:
+            return denied
+        result = await self.run(
+            self.library.change_password, session["member"],
+            text_param(params, "old"), text_param(params, "new"),
+        )
+        if result.ok:
+            session["token"] = result.data["token"]
+        return self.reply(result)
+
+    async def show_stats(self, session, params):
+        sessions = self.library.sessions
+        return 200, {"ok": True, "service": self.stats,
+                     "sessions": dict(sessions.stats, active=len(sessions))}
+
+async def serve(host=SERVICE_HOST, port=SERVICE_PORT):
+    library = Library(concurrent=True)
+    try:
+        await LibraryService(library).serve(host, port)
+    finally:
+        library.close()
+
+# ---------- LOAD GENERATOR ----------
+class Kiosk:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.token = None
+        self.latencies = []
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
 
-        if m.is_locked():
-            print(
-                f"🔒 Account locked. Try again in "
-                f"{m.lock_remaining_minutes()} minute(s)"
+    async def call(self, method, path, payload=None):
+        start = time.perf_counter()
+        headers = {"Host": self.host, "Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        self.writer.write(http_message(
+            f"{method} {path} HTTP/1.1", headers, payload or {}
+        ))
+        await self.writer.drain()
+        status_line, _, body = await read_http(self.reader)
+        body = json.loads(body) if body else {}
+        self.latencies.append(time.perf_counter() - start)
+        if "token" in body:
+            self.token = body["token"]
+        return body
+
+    def close(self):
+        self.writer.close()
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+# Each simulated kiosk signs in its own member, then repeatedly searches
+# for a title, borrows it and returns it.
+async def load_test(host=SERVICE_HOST, port=SERVICE_PORT, kiosks=200, rounds=20):
+    probe = Kiosk(host, port)
+    await probe.open()
+    titles = [b["title"] for b in (await probe.call("GET", "/books?limit=500"))["books"]]
+    probe.close()
+    if not titles:
+        print("❌ The catalog is empty")
+        return
+
+    async def run_kiosk(i):
+        kiosk = Kiosk(host, port)
+        await kiosk.open()
+        account = {"username": f"kiosk{i}", "password": "kiosk"}
+        # registering first keeps a fresh run from failing logins, which
+        # would throttle the shared source address
+        if (await kiosk.call("POST", "/register", account))["code"] == "exists":
+            await kiosk.call("POST", "/login", account)
+        rng = random.Random(i)
+        for _ in range(rounds):
+            title = rng.choice(titles)
+            word = (tokenize(title) or [title])[0]
+            await kiosk.call("GET", f"/search?q={quote(word)}")
+            if (await kiosk.call("POST", "/borrow", {"title": title}))["ok"]:
+                await kiosk.call("POST", "/return", {"title": title})
+        kiosk.close()
+        return kiosk.latencies
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_kiosk(i) for i in range(kiosks)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(t for r in results for t in r)
+    print(f"📈 {len(latencies)} requests from {kiosks} kiosks in {elapsed:.2f}s")
+    print(f"   {len(latencies) / elapsed:.0f} requests/s | "
+          f"p50 {percentile(latencies, 0.50) * 1000:.1f} ms | "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+# ================= BENCHMARKS =================
+# Each benchmark builds its own data files in a temporary directory, so it
+# never touches the real ones, and prints what it measured.
+BENCH_WORDS = (
+    "history", "of", "the", "python", "river", "data", "garden", "war",
+    "love", "science", "night", "city", "art", "music", "kingdom", "ocean",
+)
+
+@contextmanager
+def scratch_dir():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as path:
+        os.chdir(path)
+        try:
+            yield path
+        finally:
+            os.chdir(cwd)
+
+# n synthetic books; a share of them borrowed, due from two months ago to a
+# week ahead
+def sample_books(n, borrowed=0.0, seed=1):
+    rng = random.Random(seed)
+    now = datetime.now()
+    for i in range(n):
+        book = Book(
+            f"{rng.choice(BENCH_WORDS).title()} {rng.choice(BENCH_WORDS)} {i}",
+            f"Author {rng.randrange(1000)}",
+        )
+        if rng.random() < borrowed:
+            book.is_borrowed = True
+            book.borrowed_by = f"member{rng.randrange(500)}"
+            book.due_date = now + timedelta(
+                seconds=rng.randrange(-60 * 86400, 7 * 86400)
             )
+        yield book
+
+def write_books_file(books, path=BOOKS_FILE):
+    with open(path, "w") as f:
+        f.writelines(b.to_file() for b in books)
+
+def per_second(count, seconds):
+    return f"{count / max(seconds, 1e-9):,.0f}"
+
+# title lookups through the index against the scan it replaced, which
+# compared lower() of every title in the catalog on every request
+def bench_index(books=200000, ops=20000, scans=20):
+    with scratch_dir():
+        write_books_file(sample_books(books))
+        library = Library(durability="none")
+        member = Member("bench", legacy_hash("bench"))
+        library.add_member(member)
+        rng = random.Random(2)
+        titles = [library.books[rng.randrange(books)].title for _ in range(ops)]
+
+        def linear_find(title):
+            for b in library.books:
+                if b.title.lower() == title.lower() and not b.is_borrowed:
+                    return b
             return None
 
-        p = hash_password(input("Password: "))
+        start = time.perf_counter()
+        for title in titles[:scans]:
+            linear_find(title)
+        linear = (time.perf_counter() - start) / scans
+        start = time.perf_counter()
+        for title in titles:
+            library.find_available(title)
+        indexed = (time.perf_counter() - start) / ops
+        start = time.perf_counter()
+        for title in titles:
+            library.borrow_book(member, title)
+            library.return_book(member, title)
+        elapsed = time.perf_counter() - start
+        library.close()
+    print(f"📊 Title lookup over {books:,} books")
+    print(f"   linear scan: {linear * 1e6:,.1f} µs per lookup")
+    print(f"   title index: {indexed * 1e6:,.2f} µs per lookup "
+          f"({linear / indexed:,.0f}x faster)")
+    print(f"   borrow + return through Library: "
+          f"{per_second(2 * ops, elapsed)} ops/s")
+
+# journaled borrow/return ops per second in each durability mode, then
+# the time to fold the journal into the snapshot files (temp file + rename)
+def bench_durability(books=200000, ops=5000):
+    print(f"📊 Durability modes, {books:,} books, {ops:,} ops each")
+    for mode in ("fsync", "group", "none"):
+        with scratch_dir():
+            write_books_file(sample_books(books))
+            library = Library(durability=mode)
+            member = Member("bench", legacy_hash("bench"))
+            library.add_member(member)
+            rng = random.Random(2)
+            titles = [library.books[rng.randrange(books)].title
+                      for _ in range(ops // 2)]
+            start = time.perf_counter()
+            for title in titles:
+                library.borrow_book(member, title)
+                library.return_book(member, title)
+            library.sync()
+            elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            library.compact()
+            compacted = time.perf_counter() - start
+            syncs = library.storage.stats["syncs"]
+            library.close()
+        print(f"   {mode:>5}: {per_second(2 * len(titles), elapsed):>8} ops/s, "
+              f"{syncs} syncs, compaction {compacted:.2f}s")
+
+# reading the catalog alone, then a whole Library start, from books.txt
+# and from the binary catalog
+def bench_startup(books=500000):
+    with scratch_dir():
+        write_books_file(sample_books(books, borrowed=0.1))
+        convert_books_file()
+        TextStorage().close()   # the members file, so it is not timed below
+        print(f"📊 Startup, {books:,} books")
+
+        def report(label, load):
+            start = time.perf_counter()
+            with paused_gc():
+                load()
+            elapsed = time.perf_counter() - start
+            print(f"   {label:<34} {elapsed:6.2f}s "
+                  f"{per_second(books, elapsed):>10} rows/s")
+
+        def from_file():
+            with open(BOOKS_FILE) as f:
+                return [Book.from_file(line) for line in f]
+
+        def binary_books():
+            with BinaryCatalog(BOOKS_BIN_FILE) as catalog:
+                return list(catalog)
+
+        def binary_columns():
+            with BinaryCatalog(BOOKS_BIN_FILE) as catalog:
+                ColumnarBooks().load_catalog(catalog)
+
+        def library(books_format, catalog):
+            return lambda: Library(
+                TextStorage("none", books_format=books_format), catalog=catalog
+            ).close()
+
+        report("Book.from_file per line", from_file)
+        report("binary catalog, Book per row", binary_books)
+        report("binary catalog, columns (mmap)", binary_columns)
+        report("Library, text + objects", library("text", "objects"))
+        report("Library, binary + objects", library("binary", "objects"))
+        report("Library, binary + columnar", library("binary", "columnar"))
+
+# records per second through the from_file classmethods with the cyclic
+# collector running and with it paused as the loaders do (paused_gc)
+def bench_parser(books=500000, members=200000):
+    with scratch_dir():
+        write_books_file(sample_books(books, borrowed=0.1))
+        rng = random.Random(3)
+        with open(MEMBERS_FILE, "w") as f:
+            for i in range(members):
+                loans = [f"Book {rng.randrange(books)}"
+                         for _ in range(rng.randrange(MAX_BOOKS_PER_MEMBER + 1))]
+                m = Member(f"member{i}", legacy_hash(str(i)), books=loans)
+                f.write(m.to_file())
+        print(f"📊 Parsers, {books:,} books and {members:,} members")
+        for path, cls, count in ((BOOKS_FILE, Book, books),
+                                 (MEMBERS_FILE, Member, members)):
+            with open(path) as f:
+                lines = f.readlines()
+            # best of three, alternating, so neither gets a warmer allocator
+            timings = [math.inf, math.inf]
+            for _ in range(3):
+                for n, gc_context in enumerate((nullcontext, paused_gc)):
+                    start = time.perf_counter()
+                    with gc_context():
+                        [cls.from_file(line) for line in lines]
+                    timings[n] = min(timings[n], time.perf_counter() - start)
+            collected, paused = timings
+            print(f"   {cls.__name__:<6} GC on {per_second(count, collected):>10} "
+                  f"rows/s | GC paused {per_second(count, paused):>10} rows/s "
+                  f"({collected / paused:.2f}x)")
+
+# the records as they were before __slots__ and interning, for bench_memory
+class DictBook:
+    def __init__(self, title, author):
+        self.title = title
+        self.author = author
+        self.is_borrowed = False
+        self.due_date = None
+        self.borrowed_by = None
+
+class DictMember:
+    def __init__(self, username, password, role, books, failed_attempts,
+                 lock_until):
+        self.username = username
+        self.password = password
+        self.role = role
+        self.books = books
+        self.failed_attempts = failed_attempts
+        self.lock_until = lock_until
+
+def dict_book(line):
+    title, author, borrowed, due, by = line.strip().split("|")
+    book = DictBook(title, author)
+    book.is_borrowed = borrowed == "True"
+    book.due_date = None if due == "None" else datetime.fromisoformat(due)
+    book.borrowed_by = None if by == "None" else by
+    return book
+
+def dict_member(line):
+    parts = line.strip().split("|")
+    return DictMember(
+        parts[0], parts[1], parts[2], parts[3].split(",") if parts[3] else [],
+        int(parts[4]), None if parts[5] == "None" else datetime.fromisoformat(parts[5]),
+    )
+
+# bytes allocated per loaded record (tracemalloc), from the same lines
+def bench_memory(books=200000, members=100000):
+    rng = random.Random(3)
+    book_lines = [b.to_file() for b in sample_books(books, borrowed=0.3)]
+    member_lines = [
+        Member(f"member{i}", legacy_hash(str(i)), books=[
+            f"Book {rng.randrange(books)}"
+            for _ in range(rng.randrange(MAX_BOOKS_PER_MEMBER + 1))
+        ]).to_file()
+        for i in range(members)
+    ]
+
+    def measure(load, count):
+        tracemalloc.start()
+        try:
+            loaded = load()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del loaded
+        return size / count
+
+    def columnar():
+        store = ColumnarBooks()
+        for book in map(Book.from_file, book_lines):
+            store.append(book)
+        return store
+
+    print(f"📊 Memory per record, {books:,} books and {members:,} members")
+    for label, load, count in (
+        ("Book with __dict__", lambda: [dict_book(l) for l in book_lines], books),
+        ("Book, slots + interned", lambda: [Book.from_file(l) for l in book_lines],
+         books),
+        ("columnar catalog", columnar, books),
+        ("Member with __dict__", lambda: [dict_member(l) for l in member_lines], members),
+        ("Member, slots + interned",
+         lambda: [Member.from_file(l) for l in member_lines], members),
+    ):
+        print(f"   {label:<26} {measure(load, count):7.1f} bytes")
+
+# raw operations per second through the headless core, no fsync; logins
+# run the configured password KDF, so they get their own, smaller count
+def bench_core(books=100000, ops=20000, logins=20):
+    with scratch_dir():
+        write_books_file(sample_books(books))
+        library = Library(durability="none")
+        password = "bench-password"
+        member = library.register("bench", password).data["member"]
+        rng = random.Random(5)
+        titles = [library.books[rng.randrange(books)].title for _ in range(ops)]
+        words = [rng.choice(BENCH_WORDS) for _ in range(ops)]
+
+        def borrow_return():
+            for title in titles[:ops // 2]:
+                library.borrow_book(member, title)
+                library.return_book(member, title)
+
+        def listing():
+            cursor = 0
+            for _ in range(ops):
+                cursor = library.list_books(cursor)[1] or 0
+
+        print(f"📊 Core operations, {books:,} books")
+        for label, count, run in (
+            ("add_book", ops, lambda: [library.add_book(f"New {i}", "Bench")
+                                       for i in range(ops)]),
+            ("borrow_book + return_book", 2 * (ops // 2), borrow_return),
+            ("search", ops, lambda: [library.search(w) for w in words]),
+            ("list_books page", ops, listing),
+            ("login, unknown user", ops, lambda: [library.login("nobody", "x")
+                                           for _ in range(ops)]),
+            (f"login ({PASSWORD_KDF})", logins,
+             lambda: [library.login("bench", password) for _ in range(logins)]),
+        ):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            print(f"   {label:<28} {per_second(count, elapsed):>10} ops/s")
+        library.close()
 
-        if p == m.password:
-            m.failed_attempts = 0
-            m.lock_until = None
-            self.save_members()
-            print(f"✅ Login successful ({m.role})")
-            return m
+# logins per second under each PASSWORD_KDF setting, on one thread and on
+# `threads`, each signing in its own member; hashlib releases the GIL, so
+# pbkdf2 and scrypt can use a core per thread
+def bench_kdf(threads=os.cpu_count() or 2, seconds=2):
+    global PASSWORD_KDF
+    configured = PASSWORD_KDF
+    password = "bench-password"
+    print(f"📊 Logins per second by KDF, {seconds}s per run")
+    try:
+        for kdf in ("sha256", "pbkdf2", "scrypt"):
+            # set while logging in too, or the first login would rehash
+            PASSWORD_KDF = kdf
+            with scratch_dir():
+                library = Library(durability="none", concurrent=True)
+                for i in range(threads):
+                    library.add_registered(f"bench{i}", hash_password(password))
+                rates = []
+                for n in sorted({1, threads}):
+                    counts = [0] * n
+                    deadline = time.perf_counter() + seconds
 
-        # WRONG PASSWORD
-        m.failed_attempts += 1
-        if m.failed_attempts >= MAX_LOGIN_ATTEMPTS:
-            m.lock_until = datetime.now() + timedelta(minutes=LOCK_MINUTES)
-            print(f"🔒 Account locked for {LOCK_MINUTES} minutes")
+                    def worker(i):
+                        while time.perf_counter() < deadline:
+                            counts[i] += library.login(f"bench{i}", password).ok
+
+                    workers = [threading.Thread(target=worker, args=(i,))
+                               for i in range(n)]
+                    start = time.perf_counter()
+                    for t in workers:
+                        t.start()
+                    for t in workers:
+                        t.join()
+                    elapsed = time.perf_counter() - start
+                    rates.append(f"{n:>3} thread(s) "
+                                 f"{per_second(sum(counts), elapsed):>9}/s")
+                library.close()
+            print(f"   {kdf:<7} " + "   ".join(rates))
+    finally:
+        PASSWORD_KDF = configured
+
+BENCHMARKS = {
+    "index": bench_index,
+    "durability": bench_durability,
+    "startup": bench_startup,
+    "parser": bench_parser,
+    "memory": bench_memory,
+    "core": bench_core,
+    "kdf": bench_kdf,
+}
+
+# ================= CHECKS =================
+# Each check builds its own data in a temporary directory like the
+# benchmarks, and raises AssertionError when the library gets it wrong.
+def expect(ok, message):
+    if not ok:
+        raise AssertionError(message)
+
+# the batch fine engines against Book.fine, one book at a time, at the
+# same reference time; due dates fall on and either side of whole days
+def check_fines(books=100000):
+    now = datetime(2026, 1, 15, 12, 30, 15, 250000)
+    rng = random.Random(4)
+    corpus = []
+    for i in range(books):
+        book = Book(f"Fine {i}", "Author")
+        if rng.random() < 0.8:
+            book.is_borrowed = True
+            book.borrowed_by = f"member{rng.randrange(300)}"
+            book.due_date = now - timedelta(
+                days=rng.randrange(-10, 400),
+                microseconds=rng.choice((-1, 0, 1, rng.randrange(DAY_US))),
+            )
+        corpus.append(book)
+    expected = {}
+    for book in corpus:
+        fine = book.fine(now)
+        if fine:
+            expected[book.borrowed_by] = expected.get(book.borrowed_by, 0) + fine
+    store = ColumnarBooks()
+    for book in corpus:
+        store.append(book)
+    now_us = to_epoch_us(now)
+    engines = {
+        "fine_totals": fine_totals(corpus, now),
+        "columnar_fine_totals": columnar_fine_totals(store, now_us),
+    }
+    if np is not None:
+        engines["columnar_fine_totals_np"] = columnar_fine_totals_np(store, now_us)
+    for name, totals in engines.items():
+        expect(totals == expected, f"{name} disagrees with Book.fine")
+    print(f"✅ {', '.join(engines)} match Book.fine: {books:,} books, "
+          f"{len(expected)} members owing {sum(expected.values()):,} TZS")
+
+# Every loan must be recorded once on each side: copies lent to a member,
+# per title, match that member's loan list, and no one is over the limit.
+# A copy lent twice shows up as a loan the catalog does not have.
+# Returns the number of copies on loan.
+def check_loans(library):
+    lent = {}
+    for b in library.books:
+        if b.is_borrowed:
+            expect(b.borrowed_by is not None, f"book {b.id} is lent to nobody")
+            key = (username_key(b.borrowed_by), title_key(b.title))
+            lent[key] = lent.get(key, 0) + 1
+    loans = {}
+    for m in library.members:
+        expect(len(m.books) <= MAX_BOOKS_PER_MEMBER,
+               f"{m.username} holds {len(m.books)} books")
+        for title in m.books:
+            key = (username_key(m.username), title_key(title))
+            loans[key] = loans.get(key, 0) + 1
+    expect(lent == loans, "member loans and the catalog disagree")
+    return sum(lent.values())
+
+# a small catalog with two copies of each title, so borrowers collide
+def contended_library(titles=100, members=300, **options):
+    library = Library(durability="none", **options)
+    with library.batch():
+        library.add_books(
+            (f"Title {i % titles}", f"Author {i % 7}") for i in range(2 * titles)
+        )
+        for i in range(members):
+            library.add_registered(f"member{i}", legacy_hash("x"))
+    return library
+
+# random members borrowing random titles and returning one of their own
+# loans; returns (borrows, returns) that succeeded
+def circulate(library, ops, seed):
+    rng = random.Random(seed)
+    titles = sorted({b.title for b in library.books})
+    members = list(library.members)
+    borrows = returns = 0
+    for _ in range(ops):
+        member = rng.choice(members)
+        # a copy, as other threads change the list
+        loans = list(member.books)
+        if loans and rng.random() < 0.5:
+            returns += library.return_book(member, rng.choice(loans)).ok
         else:
-            print(
-                f"❌ Wrong password "
-                f"({m.failed_attempts}/{MAX_LOGIN_ATTEMPTS})"
+            borrows += library.borrow_book(member, rng.choice(titles)).ok
+    return borrows, returns
+
+# Threads borrow and return the same few titles through one concurrent
+# Library. No copy may be lent twice, the loans must add up, and the files
+# must load back to the same state. Run at 1, 2, 4 .. threads to show how
+# throughput scales.
+def check_threads(threads=8, ops=40000):
+    counts = sorted({threads} | {2 ** i for i in range(threads.bit_length())
+                                 if 2 ** i < threads})
+    print(f"🧵 {ops:,} borrow/return ops per run")
+    for n in counts:
+        with scratch_dir():
+            library = contended_library(concurrent=True)
+            results = [None] * n
+            start_line = threading.Barrier(n + 1)
+
+            def worker(i):
+                start_line.wait()
+                results[i] = circulate(library, ops // n, seed=i)
+
+            workers = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+            for t in workers:
+                t.start()
+            start_line.wait()
+            start = time.perf_counter()
+            for t in workers:
+                t.join()
+            elapsed = time.perf_counter() - start
+            library.sync()
+            borrows = sum(r[0] for r in results)
+            returns = sum(r[1] for r in results)
+            lent = check_loans(library)
+            expect(lent == borrows - returns,
+                   f"{lent} on loan after {borrows} borrows, {returns} returns")
+            state = sorted(b.to_file() for b in library.books)
+            library.close()
+            reopened = Library(durability="none")
+            expect(check_loans(reopened) == lent, "the files lost loans")
+            expect(sorted(b.to_file() for b in reopened.books) == state,
+                   "the files differ from memory")
+            reopened.close()
+        print(f"   {n:>3} threads: {per_second(n * (ops // n), elapsed):>8} ops/s, "
+              f"{borrows:,} borrows, {returns:,} returns, {lent} on loan")
+    print("✅ No copy lent twice and every loan accounted for")
+
+def circulation_process(storage, ops, seed, results):
+    library = Library(storage, durability="none", shared=True)
+    start = time.perf_counter()
+    borrows, returns = circulate(library, ops, seed)
+    elapsed = time.perf_counter() - start
+    results.put((borrows, returns, library.stats["conflicts"],
+                 library.stats["reloads"], library.storage.stats["lock_wait"],
+                 elapsed))
+    library.close()
+
+# Processes borrow and return the same few titles through shared data
+# files, for each storage backend. No update may be lost: the copies on
+# loan in the files must equal the successful borrows minus returns.
+def check_processes(processes=4, ops=20000):
+    print(f"🔀 {processes} processes, {ops:,} borrow/return ops in total")
+    for storage in ("text", "sqlite"):
+        with scratch_dir():
+            contended_library(storage=storage, shared=True).close()
+            results = multiprocessing.Queue()
+            workers = [
+                multiprocessing.Process(
+                    target=circulation_process,
+                    args=(storage, ops // processes, seed, results),
+                )
+                for seed in range(processes)
+            ]
+            start = time.perf_counter()
+            for p in workers:
+                p.start()
+            counts = [results.get() for _ in workers]
+            for p in workers:
+                p.join()
+            elapsed = time.perf_counter() - start
+            borrows, returns, conflicts, reloads = (
+                sum(c[i] for c in counts) for i in range(4)
             )
+            lock_wait = sum(c[4] for c in counts) / sum(c[5] for c in counts)
+            library = Library(storage, durability="none", shared=True)
+            lent = check_loans(library)
+            library.close()
+            expect(lent == borrows - returns,
+                   f"{storage}: {lent} on loan after {borrows} borrows, "
+                   f"{returns} returns: updates were lost")
+        done = processes * (ops // processes)
+        print(f"   {storage:>6}: {per_second(done, elapsed):>7} ops/s, "
+              f"{borrows:,} borrows, {returns:,} returns, {lent} on loan")
+        print(f"           {conflicts} stale writes retried, {reloads} reloads, "
+              f"{lock_wait:.0%} of the time waiting for the lock")
+    print("✅ No updates lost")
 
-        self.save_members()
+def files_size(path="."):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+# Wrong passwords arrive at `rate` a second for `seconds`, first from
+# `sources` addresses as through the service, then with no address as from
+# the console, against real and unknown usernames. Only lock changes may
+# be written, the attempt counters may not outgrow the users and addresses
+# attacked, and one core has to keep up with the rate.
+def check_logins(rate=10000, seconds=5, members=1000, sources=100):
+    attempts = rate * seconds
+    # a fifth of the names belong to no one
+    names = [f"member{i}" for i in range(members)]
+    names += [f"nobody{i}" for i in range(members // 4)]
+    print(f"🔐 {attempts:,} failed logins at {rate:,}/s, "
+          f"{len(names):,} usernames, {members:,} of them real")
+    for label, addresses in (("by address", sources), ("no address", 0)):
+        with scratch_dir():
+            library = contended_library(titles=1, members=members)
+            library.sync()
+            rng = random.Random(5)
+            codes = {}
+            writes = library.stats["writes"]
+            size = files_size()
+            step = max(1, rate // 100)
+            cpu = time.process_time()
+            start = time.perf_counter()
+            for i in range(attempts):
+                # keep to the rate in 10 ms steps
+                if i % step == 0:
+                    ahead = start + i / rate - time.perf_counter()
+                    if ahead > 0:
+                        time.sleep(ahead)
+                source = f"10.0.0.{rng.randrange(addresses)}" if addresses else None
+                result = library.login(rng.choice(names), "wrong", source)
+                codes[result.code] = codes.get(result.code, 0) + 1
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            library.sync()
+            written = library.stats["writes"] - writes
+            grown = files_size() - size
+            users = len(library.user_attempts.buckets)
+            by_source = len(library.source_attempts.buckets)
+            library.close()
+        expect("ok" not in codes, "a wrong password logged in")
+        expect(written <= members, f"{written} records written for {members} members")
+        expect(users <= members, f"{users} username counters for {members} members")
+        expect(by_source <= addresses,
+               f"{by_source} address counters for {addresses} addresses")
+        expect(elapsed <= seconds * 1.1,
+               f"{attempts:,} attempts took {elapsed:.1f}s instead of {seconds}s")
+        print(f"   {label}: {per_second(attempts, elapsed)}/s, "
+              f"{cpu / attempts * 1e6:.1f} µs CPU each, {cpu / elapsed:.0%} of a core")
+        print(f"      {written} records written ({grown:,} bytes), "
+              f"{users} username and {by_source} address counters")
+        print("      " + ", ".join(f"{n:,} {code}" for code, n in sorted(codes.items())))
+    print("✅ Writes and CPU stay bounded")
+
+CHECKS = {
+    "fines": check_fines,
+    "threads": check_threads,
+    "processes": check_processes,
+    "logins": check_logins,
+}
+
+# runs commands[name] with the remaining arguments as integers
+def run_named(commands, args):
+    if not args or args[0] not in commands:
+        print(f"Choose one of: {', '.join(commands)}")
+        return
+    commands[args[0]](*map(int, args[1:]))
+
+# ================= MENU =================
+# The interactive shell: reads input, calls the Library core, prints results.
+def book_line(b):
+    status = "Available" if not b.is_borrowed else f"Borrowed by {b.borrowed_by}"
+    return f"{b.title} - {b.author} [{status}]\n"
+
+def pick_title(suggestions):
+    if not suggestions:
         return None
+    print("Did you mean:")
+    for n, t in enumerate(suggestions, 1):
+        print(f"{n}. {t}")
+    choice = input("Number (Enter to cancel): ")
+    if choice.isdigit() and 1 <= int(choice) <= len(suggestions):
+        return suggestions[int(choice) - 1]
+    return None
 
-    def register(self):
-        u = input("New username: ")
-        if self.find_member(u):
-            print("❌ Username exists")
-            return None
-        p = hash_password(input("Password: "))
-        m = Member(u, p)
-        self.members.append(m)
-        self.save_members()
-        print("✅ Registered successfully")
-        return m
-
-    def change_password(self, member):
-        old = hash_password(input("Old password: "))
-        if old != member.password:
-            print("❌ Wrong old password")
-            return
-        new = hash_password(input("New password: "))
-        member.password = new
-        self.save_members()
-        print("✅ Password changed")
+# unknown and locked accounts are turned away before the password prompt
+def prompt_login(library):
+    username = input("Username: ")
+    library.refresh()
+    m = library.find_member(username)
+    if not m:
+        print("❌ User not found")
+        return None
+    if m.is_locked():
+        print(library.locked_out(m).message)
+        return None
+    result = library.login(username, input("Password: "))
+    print(result.message)
+    return result.data.get("member")
 
-    # ---------- OPERATIONS ----------
-    def show_books(self):
-        print("\n📚 BOOKS")
-        for b in self.books:
-            status = "Available" if not b.is_borrowed else f"Borrowed by {b.borrowed_by}"
-            print(f"{b.title} - {b.author} [{status}]")
-
-    def add_book(self):
-        title = input("Book title: ")
-        author = input("Author: ")
-        self.books.append(Book(title, author))
-        self.save_books()
-        print("✅ Book added")
-
-    def borrow_book(self, member):
-        if len(member.books) >= MAX_BOOKS_PER_MEMBER:
-            print("❌ Maximum books reached")
-            return
-        title = input("Book title: ")
-        for b in self.books:
-            if b.title.lower() == title.lower() and not b.is_borrowed:
-                b.borrow(member)
-                member.books.append(b.title)
-                self.save_books()
-                self.save_members()
-                print("✅ Book borrowed")
-                return
-        print("❌ Book not available")
-
-    def return_book(self, member):
-        title = input("Book title: ")
-        for b in self.books:
-            if b.title.lower() == title.lower() and b.borrowed_by == member.username:
-                fine = b.fine()
-                b.return_book()
-                member.books.remove(b.title)
-                self.save_books()
-                self.save_members()
-                print(f"✅ Returned | Fine: {fine} TZS")
-                return
-        print("❌ Book not found")
+def prompt_register(library):
+    username = input("New username: ")
+    library.refresh()
+    if library.find_member(username):
+        print("❌ Username exists")
+        return None
+    result = library.register(username, input("Password: "))
+    print(result.message)
+    return result.data.get("member")
+
+def prompt_change_password(library, member):
+    old = input("Old password: ")
+    new = input("New password: ")
+    print(library.change_password(member, old, new).message)
+
+def prompt_add_book(library):
+    title = input("Book title: ")
+    author = input("Author: ")
+    print(library.add_book(title, author).message)
+
+def prompt_borrow(library, member):
+    if not member.can_borrow():
+        print("❌ Maximum books reached")
+        return
+    title = input("Book title: ")
+    result = library.borrow_book(member, title)
+    if result.code == "unavailable":
+        title = pick_title(library.complete_title(title, available_only=True))
+        if title:
+            result = library.borrow_book(member, title)
+    print(result.message)
+
+def prompt_return(library, member):
+    title = input("Book title: ")
+    result = library.return_book(member, title)
+    if result.code == "not_found":
+        title = pick_title(library.complete_title(title, member=member))
+        if title:
+            result = library.return_book(member, title)
+    print(result.message)
+
+def prompt_show_books(library, member=None):
+    print("\n1. All\n2. Available\n3. By Author\n4. Overdue")
+    if member:
+        print("5. My Books")
+    ch = input("Choose: ")
+    filters = {}
+    if ch == "2":
+        filters["available"] = True
+    elif ch == "3":
+        filters["author"] = input("Author: ")
+    elif ch == "4":
+        filters["overdue"] = True
+    elif ch == "5" and member:
+        filters["borrowed_by"] = member.username
+
+    print("\n📚 BOOKS")
+    library.refresh()
+    cursor = 0
+    while cursor is not None:
+        page, cursor = library.list_books(cursor, **filters)
+        sys.stdout.write("".join(book_line(b) for b in page))
+        if not page:
+            print("No books")
+        if cursor is not None and input("Enter for more, q to stop: ") == "q":
+            break
+
+def prompt_search(library):
+    query = input("Search: ")
+    library.refresh()
+    results = library.search(query)
+    if not results:
+        print("❌ No matching books")
+        return
+    print(f"\n🔎 RESULTS FOR '{query}'")
+    sys.stdout.write("".join(book_line(b) for b in results))
+
+def show_fines(library):
+    totals = library.outstanding_fines()
+    print("\n💰 OUTSTANDING FINES")
+    if not totals:
+        print("No outstanding fines")
+        return
+    for username, total in sorted(totals.items(), key=lambda t: -t[1]):
+        print(f"{username}: {total} TZS")
+    print(f"Total: {sum(totals.values())} TZS")
+
+def show_reminders(library):
+    now = datetime.now()
+    print("\n⏰ OVERDUE")
+    for b in library.overdue_loans(now):
+        print(f"{b.borrowed_by}: {b.title} (due {b.due_date:%Y-%m-%d %H:%M}, "
+              f"fine {b.fine(now)} TZS)")
+    print(f"\n📅 DUE IN THE NEXT {REMINDER_HOURS} HOURS")
+    for b in library.loans_due_soon(now=now):
+        print(f"{b.borrowed_by}: {b.title} (due {b.due_date:%Y-%m-%d %H:%M})")
+
+def prompt_import(library):
+    path = input("CSV or JSONL file: ")
+    try:
+        stats = import_books(library, path)
+    except OSError as e:
+        print(f"❌ Cannot read file: {e}")
+        return
+    print(
+        f"✅ Imported {stats['added']} of {stats['rows']} rows "
+        f"({stats['duplicates']} duplicates, {stats['invalid']} invalid) "
+        f"at {stats['rows_per_second']} rows/s"
+    )
+
+def prompt_export(library):
+    print("\n1. Books\n2. Members\n3. Active Loans")
+    what = {"1": "books", "2": "members", "3": "loans"}.get(input("Choose: "))
+    if not what:
+        return
+    path = input("Output file (.csv or .jsonl): ")
+    since = input("Changes since (position or YYYY-MM-DD, Enter for all): ").strip()
+    try:
+        if not since:
+            since = None
+        elif since.isdigit():
+            since = int(since)
+        else:
+            since = datetime.fromisoformat(since)
+        stats = export_records(library, path, what, since)
+    except (OSError, ValueError) as e:
+        print(f"❌ Export failed: {e}")
+        return
+    print(f"✅ Exported {stats['rows']} rows (position {stats['position']})")
+
+def compact_files(library):
+    library.compact()
+    print(
+        f"✅ Journal folded into data files "
+        f"({library.stats['writes']} writes, "
+        f"{library.stats['writes_skipped']} skipped)"
+    )
 
 # ================= MAIN =================
 def main():
@@ -260,10 +3700,11 @@ def main():
         c = input("Choose: ")
 
         if c == "1":
-            user = library.login()
+            user = prompt_login(library)
         elif c == "2":
-            user = library.register()
+            user = prompt_register(library)
         else:
+            library.close()
             break
 
         while user:
@@ -271,34 +3712,68 @@ def main():
                 print("\nADMIN MENU")
                 print("1. Add Book")
                 print("2. Show Books")
-                print("3. Change Password")
-                print("4. Logout")
+                print("3. Search Books")
+                print("4. Change Password")
+                print("5. Compact Data Files")
+                print("6. Fines Report")
+                print("7. Reminders")
+                print("8. Import Books")
+                print("9. Export Data")
+                print("10. Logout")
                 ch = input("Choose: ")
                 if ch == "1":
-                    library.add_book()
+                    prompt_add_book(library)
                 elif ch == "2":
-                    library.show_books()
+                    prompt_show_books(library)
                 elif ch == "3":
-                    library.change_password(user)
+                    prompt_search(library)
                 elif ch == "4":
+                    prompt_change_password(library, user)
+                elif ch == "5":
+                    compact_files(library)
+                elif ch == "6":
+                    show_fines(library)
+                elif ch == "7":
+                    show_reminders(library)
+                elif ch == "8":
+                    prompt_import(library)
+                elif ch == "9":
+                    prompt_export(library)
+                elif ch == "10":
                     break
             else:
                 print("\nMEMBER MENU")
                 print("1. Show Books")
-                print("2. Borrow")
-                print("3. Return")
-                print("4. Change Password")
-                print("5. Logout")
+                print("2. Search Books")
+                print("3. Borrow")
+                print("4. Return")
+                print("5. Change Password")
+                print("6. Logout")
                 ch = input("Choose: ")
                 if ch == "1":
-                    library.show_books()
+                    prompt_show_books(library, user)
                 elif ch == "2":
-                    library.borrow_book(user)
+                    prompt_search(library)
                 elif ch == "3":
-                    library.return_book(user)
+                    prompt_borrow(library, user)
                 elif ch == "4":
-                    library.change_password(user)
+                    prompt_return(library, user)
                 elif ch == "5":
+                    prompt_change_password(library, user)
+                elif ch == "6":
                     break
 
-main()
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["serve"]:
+        asyncio.run(serve())
+    elif sys.argv[1:2] == ["loadtest"]:
+        asyncio.run(load_test(
+            kiosks=int(sys.argv[2]) if len(sys.argv) > 2 else 200,
+            rounds=int(sys.argv[3]) if len(sys.argv) > 3 else 20,
+        ))
+    elif sys.argv[1:2] == ["bench"]:
+        run_named(BENCHMARKS, sys.argv[2:])
+    elif sys.argv[1:2] == ["check"]:
+        run_named(CHECKS, sys.argv[2:])
+    else:
+        main()